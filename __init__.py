@@ -22,16 +22,22 @@ import json
 import asyncio
 import tempfile
 import importlib
+import atexit
 from pathlib import Path
 from datetime import datetime, timedelta
 from tempfile import TemporaryDirectory
 from multiprocessing import Process, Value, Queue
+from queue import Empty
 from decimal import Decimal
 
 script_directory = bpy.utils.user_resource('SCRIPTS')
 sys.path.append(f"{script_directory}/addons/Golem_Cycles_GPU_Rendering")
 
-from addon_golem import render
+from render_daemon import RenderDaemon
+from dependencies import collect_dependencies, directory_size, files_size
+from job_manifest import file_hash, create_job, latest_unfinished_job
+from telemetry import JobFailed, JobFinished
+from progress import ProgressModel
 
 #################################################################################################################################
 
@@ -46,9 +52,14 @@ def create_output_directory(main_output_directory):
     os.mkdir(output_dir)
     return output_dir
 
-count = 0
-render_process = None
-queue = 0
+# Seconds between two panel updates while rendering, and events handled at most per update.
+PROGRESS_INTERVAL = 0.25
+MAX_EVENTS_PER_TICK = 500
+
+progress_model = None
+# Started with the first render of the session, and kept for the next ones.
+render_daemon = None
+current_job = None
 frames = None
 
 @persistent
@@ -57,25 +68,129 @@ def init(scene):
     bpy.context.scene.golem_settings.end_frame = bpy.context.scene.frame_end
     bpy.context.scene.golem_settings.step_frame = bpy.context.scene.render.fps
 
+def job_settings():
+    # Settings that change the rendered images: a resumed job keeps those it started with.
+    return {
+        'format': bpy.context.scene.golem_settings.output_format,
+        'split_mode': bpy.context.scene.golem_settings.split_mode,
+        'split_parts': bpy.context.scene.golem_settings.split_parts,
+        'resolution': (int(bpy.context.scene.render.resolution_x*bpy.context.scene.render.resolution_percentage/100),
+                       int(bpy.context.scene.render.resolution_y*bpy.context.scene.render.resolution_percentage/100)),
+        'samples': bpy.context.scene.cycles.samples,
+    }
+
+def log_config():
+    settings = bpy.context.scene.golem_settings
+    return {
+        'levels': {
+            'yapapi': settings.log_yapapi,
+            'activity': settings.log_activity,
+            'market': settings.log_market,
+            'payment': settings.log_payment,
+            'net': settings.log_net,
+        },
+        'rotation': settings.log_rotation,
+    }
+
+def ensure_daemon():
+    global render_daemon
+    if render_daemon is None or not render_daemon.alive():
+        render_daemon = RenderDaemon(log_config=log_config())
+    else:
+        render_daemon.set_logging(log_config())
+    return render_daemon
+
+def stop_daemon():
+    global render_daemon
+    if render_daemon is not None:
+        render_daemon.stop()
+        render_daemon = None
+
+def start_render(operator, output_directory, job_frames, settings):
+    global progress_model
+    global current_job
+    global frames
+    global render_btn
+    global cancel_btn
+    global progress_btn
+    global providers_btn
+    global running
+
+    main_blend_file = bpy.path.display_name_from_filepath(bpy.data.filepath)
+    project_directory = os.path.dirname(bpy.data.filepath)
+    project_files, missing_files, outside_files = collect_dependencies(project_directory)
+    for path in missing_files:
+        print("Missing dependency " + path)
+    for path in outside_files:
+        print("Dependency outside project directory, not packed: " + path)
+    project_size = files_size(project_files)
+    saved_size = directory_size(project_directory) - project_size
+    operator.report({'INFO'}, "Packing " + str(len(project_files)) + " files (" + str(round(project_size/1048576, 1)) + " MB), " + str(round(saved_size/1048576, 1)) + " MB saved")
+
+    render_btn = False
+    progress_btn = True
+    providers_btn = True
+    cancel_btn = True
+
+    frames = job_frames
+    progress_model = ProgressModel(len(frames))
+    bpy.context.scene.golem_settings.estimated_cost = 0
+    bpy.context.scene.golem_settings.estimated_time = ""
+    show_progress()
+
+    spec = {
+        'network': bpy.context.scene.golem_settings.network,
+        'budget': bpy.context.scene.golem_settings.budget,
+        'job': {
+            'start_price': bpy.context.scene.golem_settings.start_price/3600000,
+            'cpu_price': bpy.context.scene.golem_settings.cpu_price/3600000,
+            'env_price': bpy.context.scene.golem_settings.env_price/3600000,
+            'timeout_global': bpy.context.scene.golem_settings.timeout_global,
+            'timeout_upload': bpy.context.scene.golem_settings.timeout_upload,
+            'timeout_render': bpy.context.scene.golem_settings.timeout_render,
+            'workers': bpy.context.scene.golem_settings.workers,
+            'memory': bpy.context.scene.golem_settings.memory,
+            'storage': bpy.context.scene.golem_settings.storage,
+            'threads': bpy.context.scene.golem_settings.threads,
+            'format': settings['format'],
+            'scene': main_blend_file,
+            'frames': frames,
+            'output_dir': output_directory,
+            'project_directory': project_directory,
+            'project_files': project_files,
+            'engine': bpy.context.scene.golem_settings.engine,
+            'pipeline_depth': bpy.context.scene.golem_settings.pipeline_depth,
+            'split_mode': settings['split_mode'],
+            'split_parts': settings['split_parts'],
+            'resolution': tuple(settings['resolution']),
+            'samples': settings['samples'],
+            'blender_binary': bpy.app.binary_path,
+            'selection': bpy.context.scene.golem_settings.selection,
+            'deadline': bpy.context.scene.golem_settings.deadline,
+            'timeout_percentile': bpy.context.scene.golem_settings.timeout_percentile,
+            'timeout_margin': bpy.context.scene.golem_settings.timeout_margin,
+            'estimate_every': bpy.context.scene.golem_settings.estimate_every,
+            'transfer': bpy.context.scene.golem_settings.output_transfer,
+            'exr_codec': None if bpy.context.scene.golem_settings.exr_codec == "SCENE" else bpy.context.scene.golem_settings.exr_codec,
+            'png_compression': None if bpy.context.scene.golem_settings.png_compression < 0 else bpy.context.scene.golem_settings.png_compression,
+            'check_frames': bpy.context.scene.golem_settings.check_frames,
+            'contact_sheet': bpy.context.scene.golem_settings.contact_sheet,
+            'preview_movie': bpy.context.scene.golem_settings.preview_movie,
+            'preview_fps': bpy.context.scene.render.fps,
+        },
+    }
+    current_job = ensure_daemon().submit(spec)
+    running = True
+    bpy.app.timers.register(update_progress)
+
 class Golem_Render(bpy.types.Operator):
     bl_idname = "golem_render.render"
     bl_label = "Render"
 
     def execute(self, context):
-        global render_process
-        global count
-        global queue
-        global frames
-        global render_btn
-        global cancel_btn
-        global progress_btn
-        global providers_btn
-        global running
-
         if not running:
             main_blend_file = bpy.path.display_name_from_filepath(bpy.data.filepath)
             main_output_directory = bpy.path.abspath(bpy.context.scene.render.filepath)
-            output_directory = create_output_directory(main_output_directory)
             children = Path(bpy.path.abspath(bpy.data.filepath))
             root = Path(main_output_directory)
 
@@ -83,123 +198,115 @@ class Golem_Render(bpy.types.Operator):
                 ShowMessageBox("Please select folder outside project directory", "Output folder error", 'ERROR')
                 return {'FINISHED'}
 
-            render_btn = False
-            progress_btn = True
-            providers_btn = True
-            cancel_btn = True
-
-            count = 0
-            bpy.context.scene.golem_settings.progress = 0
-            bpy.context.scene.golem_settings.providers = 0
-
-            bpy.app.timers.register(update_progress)
-
-            frames = list(range(bpy.context.scene.golem_settings.start_frame, bpy.context.scene.golem_settings.end_frame+1, bpy.context.scene.golem_settings.step_frame))
-            queue = Queue()
-
-            render_process = Process(target=render, args=(main_blend_file,
-                                                            os.path.dirname(bpy.data.filepath),
-                                                            output_directory,
-                                                            frames,
-                                                            queue,
-                                                            bpy.context.scene.golem_settings.network,
-                                                            bpy.context.scene.golem_settings.budget,
-                                                            (bpy.context.scene.golem_settings.start_price/3600000),
-                                                            (bpy.context.scene.golem_settings.cpu_price/3600000),
-                                                            (bpy.context.scene.golem_settings.env_price/3600000),
-                                                            bpy.context.scene.golem_settings.timeout_global,
-                                                            bpy.context.scene.golem_settings.timeout_upload,
-                                                            bpy.context.scene.golem_settings.timeout_render,
-                                                            bpy.context.scene.golem_settings.workers,
-                                                            bpy.context.scene.golem_settings.memory,
-                                                            bpy.context.scene.golem_settings.storage,
-                                                            bpy.context.scene.golem_settings.threads,
-                                                            bpy.context.scene.golem_settings.output_format))
-            running = True
-            render_process.start()
+            output_directory = create_output_directory(main_output_directory)
+            job_frames = list(range(bpy.context.scene.golem_settings.start_frame, bpy.context.scene.golem_settings.end_frame+1, bpy.context.scene.golem_settings.step_frame))
+            job = create_job(output_directory, main_blend_file, file_hash(bpy.data.filepath), job_frames, job_settings())
+            start_render(self, output_directory, job_frames, job['settings'])
 
         return {'FINISHED'}
 
-def update_progress():
-    global count
-    global queue
-    global render_process
+class Golem_Resume(bpy.types.Operator):
+    bl_idname = "golem_resume.resume"
+    bl_label = "Resume"
+
+    def execute(self, context):
+        if not running:
+            main_blend_file = bpy.path.display_name_from_filepath(bpy.data.filepath)
+            main_output_directory = bpy.path.abspath(bpy.context.scene.render.filepath)
+            unfinished = latest_unfinished_job(main_output_directory, main_blend_file)
+            if unfinished is None:
+                ShowMessageBox("No unfinished job of this scene in the output folder", "Nothing to resume", 'INFO')
+                return {'FINISHED'}
+
+            output_directory, job, missing = unfinished
+            if job['scene_hash'] != file_hash(bpy.data.filepath):
+                self.report({'WARNING'}, "Scene changed since this job started, resuming anyway")
+            self.report({'INFO'}, "Resuming " + str(len(missing)) + "/" + str(len(job['frames'])) + " frames in " + output_directory)
+            start_render(self, output_directory, missing, job['settings'])
+
+        return {'FINISHED'}
+
+FAILURE_MESSAGES = {
+    "yagna_not_started": ("Please start yagna with command: yagna service run", "Yagna error"),
+    "yagna_not_installed": ("Please install yagna and add to PATH", "Yagna error"),
+    "insufficient_funds": ("Please get funds with command: yagna payment fund", "Insufficient funds"),
+}
+
+def stop_render(terminate):
     global render_btn
     global progress_btn
     global providers_btn
     global cancel_btn
     global running
 
-    try:
-        msg = queue.get(block=False)
-        if msg == "frame_finished":
-            if frames is not None:
-                count += 1
-                bpy.context.scene.golem_settings.progress = int(count*100/len(frames))
-                if count == len(frames):
-                    bpy.app.timers.unregister(update_progress)
-                    render_btn = True
-                    progress_btn = False
-                    providers_btn = False
-                    cancel_btn = False
-                    running = False
-        elif msg == "add_provider":
-            bpy.context.scene.golem_settings.providers += 1
-        elif msg == "remove_provider":
-            bpy.context.scene.golem_settings.providers -= 1
-        elif msg == "yagna_not_started":
-            ShowMessageBox("Please start yagna with command: yagna service run", "Yagna error", 'ERROR')
-            running = False
-            render_process.terminate()
-            bpy.app.timers.unregister(update_progress)
-            render_btn = True
-            progress_btn = False
-            providers_btn = False
-            cancel_btn = False
-        elif msg == "yagna_not_installed":
-            ShowMessageBox("Please install yagna and add to PATH", "Yagna error", 'ERROR')
-            running = False
-            render_process.terminate()
-            bpy.app.timers.unregister(update_progress)
-            render_btn = True
-            progress_btn = False
-            providers_btn = False
-            cancel_btn = False
-        elif msg == "insufficient_funds":
-            ShowMessageBox("Please get funds with command: yagna payment fund", "Insufficient funds", 'ERROR')
-            running = False
-            render_process.terminate()
-            bpy.app.timers.unregister(update_progress)
-            render_btn = True
-            progress_btn = False
-            providers_btn = False
-            cancel_btn = False
-    except:
-        pass
+    running = False
+    if terminate:
+        render_daemon.cancel(current_job)
+    if bpy.app.timers.is_registered(update_progress):
+        bpy.app.timers.unregister(update_progress)
+    render_btn = True
+    progress_btn = False
+    providers_btn = False
+    cancel_btn = False
+
+def show_progress():
+    settings = bpy.context.scene.golem_settings
+    settings.progress = int(progress_model.done*100/max(progress_model.total, 1))
+    settings.providers = len(progress_model.active)
+    settings.in_flight = progress_model.in_flight
+    settings.failed = progress_model.failed
+    settings.frames_per_minute = progress_model.frames_per_minute()
+    settings.spent = progress_model.spent
+    eta = progress_model.eta_seconds()
+    settings.eta = str(timedelta(seconds=int(eta))) if eta is not None else ""
+    if progress_model.estimate:
+        settings.estimated_cost = progress_model.estimate.cost
+        settings.estimated_time = str(timedelta(seconds=progress_model.estimate.seconds))
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'PROPERTIES':
+                area.tag_redraw()
 
-    return 1.0
+def update_progress():
+    # Drains what the render daemon sent since the last tick, a bounded number of events per tick.
+    # Events of earlier jobs, e.g. sent while they were being cancelled, are dropped.
+    handled = 0
+    while handled < MAX_EVENTS_PER_TICK:
+        try:
+            job_id, msg = render_daemon.events.get(block=False)
+        except Empty:
+            break
+        handled += 1
+        if job_id != current_job:
+            continue
+        if isinstance(msg, JobFailed):
+            message, title = FAILURE_MESSAGES.get(msg.reason, (msg.reason, "Render error"))
+            ShowMessageBox(message, title, 'ERROR')
+            stop_render(terminate=False)
+            return None
+        if isinstance(msg, JobFinished):
+            show_progress()
+            stop_render(terminate=False)
+            return None
+        progress_model.apply(msg)
+
+    if not render_daemon.alive():
+        ShowMessageBox("The render daemon stopped, see the console", "Render error", 'ERROR')
+        stop_render(terminate=False)
+        return None
+
+    # Polled until the job ends, after its last frame: the invoices come once its agreements are over.
+    show_progress()
+    return PROGRESS_INTERVAL
 
 class Golem_Cancel(bpy.types.Operator):
     bl_idname = "golem_cancel.cancel"
     bl_label = "Cancel"
 
     def execute(self, context):
-        global render_process
-        global render_btn
-        global progress_btn
-        global providers_btn
-        global cancel_btn
-        global running
-
         if running:
-            running = False
-            render_process.terminate()
-            bpy.app.timers.unregister(update_progress)
-            render_btn = True
-            progress_btn = False
-            providers_btn = False
-            cancel_btn = False
-            print("render_process terminated")
+            stop_render(terminate=True)
+            print("render job " + current_job + " cancelled")
         return {'FINISHED'}
 
 ##########################################################################################################
@@ -238,19 +345,48 @@ class GolemRenderSettings(bpy.types.PropertyGroup):
     progress: bpy.props.IntProperty(name="Progress (%)", default=0, min=0, max=100, update=update_ui_progress)
     providers: bpy.props.IntProperty(name="Providers", default=0, min=0, max=100, update=update_ui_providers)
     workers: bpy.props.IntProperty(name="Workers", default=1, min=1, max=128)
-    memory: bpy.props.IntProperty(name="Memory (GB)", default=8, min=1, max=1024)
+    memory: bpy.props.IntProperty(name="Memory/GPU (GB)", default=8, min=1, max=1024)
     storage: bpy.props.IntProperty(name="Storage (GB)", default=8, min=1, max=1024)
-    threads: bpy.props.IntProperty(name="Threads", default=8, min=1, max=128)
+    threads: bpy.props.IntProperty(name="Threads/GPU", default=8, min=1, max=128)
     start_frame: bpy.props.IntProperty(name="Start", min=1, set=set_start_frame, get=get_start_frame)
     end_frame: bpy.props.IntProperty(name="End", min=1, set=set_end_frame, get=get_end_frame)
     step_frame: bpy.props.IntProperty(name="Step", default=1, min=1, max=100)
+    split_mode: bpy.props.EnumProperty(name="Split frames",
+            items=(
+                ("NONE", "None", ""),
+                ("TILES", "Tiles", ""),
+                ("SAMPLES", "Samples", "")
+            ),
+            default="NONE"
+        )
+    split_parts: bpy.props.IntProperty(name="Parts", default=4, min=2, max=64)
     budget: bpy.props.IntProperty(name="Budget (GLM)", default=10, min=1, max=100)
+    selection: bpy.props.EnumProperty(name="Providers",
+            items=(
+                ("PRICE", "Lowest price", ""),
+                ("THROUGHPUT", "Most frames per GLM", ""),
+                ("DEADLINE", "Fastest within deadline", "")
+            ),
+            default="PRICE"
+        )
+    deadline: bpy.props.FloatProperty(name="Deadline (h)", default=4, min=0.1, max=24)
+    estimate_every: bpy.props.IntProperty(name="Cost pre-pass (every N frames)", default=0, min=0, max=100)
+    estimated_cost: bpy.props.FloatProperty(name="Estimated cost (GLM)", default=0, precision=4)
+    in_flight: bpy.props.IntProperty(name="In flight", default=0, min=0)
+    failed: bpy.props.IntProperty(name="Failed", default=0, min=0)
+    frames_per_minute: bpy.props.FloatProperty(name="Frames/min", default=0, precision=2)
+    spent: bpy.props.FloatProperty(name="Spent (GLM)", default=0, precision=4)
+    eta: bpy.props.StringProperty(name="ETA", default="")
+    estimated_time: bpy.props.StringProperty(name="Estimated time", default="")
     start_price: bpy.props.IntProperty(name="start", default=0, min=0, max=1000)
     cpu_price: bpy.props.IntProperty(name="cpu/h", default=0, min=0, max=1000)
     env_price: bpy.props.IntProperty(name="env/h", default=0, min=0, max=1000)
+    pipeline_depth: bpy.props.IntProperty(name="Pipeline depth", default=1, min=1, max=4)
     timeout_global: bpy.props.IntProperty(name="Global (h)", default=4, min=1, max=24)
-    timeout_upload: bpy.props.IntProperty(name="Upload (mn)", default=10, min=1, max=59)
-    timeout_render: bpy.props.IntProperty(name="Render (mn)", default=10, min=1, max=59)
+    timeout_upload: bpy.props.IntProperty(name="Upload max (mn)", default=10, min=1, max=1440)
+    timeout_render: bpy.props.IntProperty(name="Render max (mn/frame)", default=10, min=1, max=1440)
+    timeout_percentile: bpy.props.IntProperty(name="Percentile", default=95, min=50, max=100)
+    timeout_margin: bpy.props.FloatProperty(name="Margin", default=2.0, min=1.0, max=10.0)
     output_format: bpy.props.EnumProperty(name="Output Format",
             items=(
                 ("PNG", "PNG", ""),
@@ -261,6 +397,87 @@ class GolemRenderSettings(bpy.types.PropertyGroup):
             ),
             default="PNG"
         )
+    engine: bpy.props.EnumProperty(name="Engine",
+            items=(
+                ("COMMAND", "Blender per chunk", ""),
+                ("SERVER", "Resident render server", "")
+            ),
+            default="COMMAND"
+        )
+    output_transfer: bpy.props.EnumProperty(name="Transfer",
+            items=(
+                ("FILES", "One download per frame", ""),
+                ("BUNDLE", "Bundle per chunk", ""),
+                ("COMPRESSED", "Compressed bundle per chunk", "")
+            ),
+            default="FILES"
+        )
+    exr_codec: bpy.props.EnumProperty(name="EXR codec",
+            items=(
+                ("SCENE", "As in the scene", ""),
+                ("ZIP", "ZIP (lossless)", ""),
+                ("PIZ", "PIZ (lossless)", ""),
+                ("DWAA", "DWAA (lossy)", ""),
+                ("NONE", "None", "")
+            ),
+            default="SCENE"
+        )
+    png_compression: bpy.props.IntProperty(name="PNG compression (%)", description="-1: as in the scene", default=-1, min=-1, max=100)
+    check_frames: bpy.props.BoolProperty(name="Check frames", description="Render again the frames that come back empty, truncated, black or with NaN pixels", default=True)
+    contact_sheet: bpy.props.BoolProperty(name="Contact sheet", default=False)
+    preview_movie: bpy.props.BoolProperty(name="Preview movie", description="Needs ffmpeg", default=False)
+    log_yapapi: bpy.props.EnumProperty(name="yapapi",
+            items=(
+                ("DEBUG", "Debug", ""),
+                ("INFO", "Info", ""),
+                ("WARNING", "Warning", ""),
+                ("ERROR", "Error", "")
+            ),
+            default="INFO"
+        )
+    log_activity: bpy.props.EnumProperty(name="Activity API",
+            items=(
+                ("DEBUG", "Debug", ""),
+                ("INFO", "Info", ""),
+                ("WARNING", "Warning", ""),
+                ("ERROR", "Error", "")
+            ),
+            default="WARNING"
+        )
+    log_market: bpy.props.EnumProperty(name="Market API",
+            items=(
+                ("DEBUG", "Debug", ""),
+                ("INFO", "Info", ""),
+                ("WARNING", "Warning", ""),
+                ("ERROR", "Error", "")
+            ),
+            default="WARNING"
+        )
+    log_payment: bpy.props.EnumProperty(name="Payment API",
+            items=(
+                ("DEBUG", "Debug", ""),
+                ("INFO", "Info", ""),
+                ("WARNING", "Warning", ""),
+                ("ERROR", "Error", "")
+            ),
+            default="WARNING"
+        )
+    log_net: bpy.props.EnumProperty(name="Net API",
+            items=(
+                ("DEBUG", "Debug", ""),
+                ("INFO", "Info", ""),
+                ("WARNING", "Warning", ""),
+                ("ERROR", "Error", "")
+            ),
+            default="WARNING"
+        )
+    log_rotation: bpy.props.EnumProperty(name="Rotation",
+            items=(
+                ("SIZE", "Every 100 MB", ""),
+                ("DAILY", "Daily", "")
+            ),
+            default="SIZE"
+        )
     network: bpy.props.EnumProperty(name="Network",
             items=(
                 ("goerli", "Goerli (ETH)", ""),
@@ -297,6 +514,16 @@ class LayoutDemoPanel(bpy.types.Panel):
 
         row = box_anim_settings.row()
         row.prop(bpy.context.scene.golem_settings, "output_format")
+        if bpy.context.scene.golem_settings.output_format in ["OPEN_EXR", "OPEN_EXR_MULTILAYER"]:
+            row.prop(bpy.context.scene.golem_settings, "exr_codec")
+        elif bpy.context.scene.golem_settings.output_format == "PNG":
+            row.prop(bpy.context.scene.golem_settings, "png_compression")
+        row = box_anim_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "output_transfer")
+        row = box_anim_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "check_frames")
+        row.prop(bpy.context.scene.golem_settings, "contact_sheet")
+        row.prop(bpy.context.scene.golem_settings, "preview_movie")
         row = box_anim_settings.row()
         row.prop(scene.render, "filepath")
 
@@ -305,14 +532,29 @@ class LayoutDemoPanel(bpy.types.Panel):
         row.prop(bpy.context.scene.golem_settings, "end_frame")
         row.prop(bpy.context.scene.golem_settings, "step_frame")
 
+        row = box_anim_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "split_mode")
+        row.prop(bpy.context.scene.golem_settings, "split_parts")
+
         box_golem_settings = layout.box()
 
         row = box_golem_settings.row()
         row.prop(bpy.context.scene.golem_settings, "network")
 
+        row = box_golem_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "engine")
+        row.prop(bpy.context.scene.golem_settings, "pipeline_depth")
+
         row = box_golem_settings.row()
         row.prop(bpy.context.scene.golem_settings, "budget")
 
+        row = box_golem_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "selection")
+        row.prop(bpy.context.scene.golem_settings, "deadline")
+
+        row = box_golem_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "estimate_every")
+
         row = box_golem_settings.row()
         row.prop(bpy.context.scene.golem_settings, "workers")
         row.prop(bpy.context.scene.golem_settings, "memory")
@@ -331,12 +573,28 @@ class LayoutDemoPanel(bpy.types.Panel):
         row.prop(bpy.context.scene.golem_settings, "timeout_upload")
         row.prop(bpy.context.scene.golem_settings, "timeout_render")
 
+        row = box_golem_settings.row()
+        row.label(text="Frame timeout:")
+        row.prop(bpy.context.scene.golem_settings, "timeout_percentile")
+        row.prop(bpy.context.scene.golem_settings, "timeout_margin")
+
+        row = box_golem_settings.row()
+        row.label(text="Requestor log:")
+        row.prop(bpy.context.scene.golem_settings, "log_yapapi")
+        row.prop(bpy.context.scene.golem_settings, "log_rotation")
+        row = box_golem_settings.row()
+        row.prop(bpy.context.scene.golem_settings, "log_activity")
+        row.prop(bpy.context.scene.golem_settings, "log_market")
+        row.prop(bpy.context.scene.golem_settings, "log_payment")
+        row.prop(bpy.context.scene.golem_settings, "log_net")
+
         row = layout.row()
 
         split = row.split(factor=0.5)
         coll = split.column()
         row = coll.row()
         row.operator("Golem_Render.render")
+        row.operator("Golem_Resume.resume")
         row.enabled = render_btn
         row = coll.row()
         row.operator("Golem_Cancel.cancel")
@@ -348,6 +606,24 @@ class LayoutDemoPanel(bpy.types.Panel):
         row = colr.row()
         row.prop(bpy.context.scene.golem_settings, "providers")
         row.enabled = providers_btn
+        row = colr.row()
+        row.prop(bpy.context.scene.golem_settings, "in_flight")
+        row.prop(bpy.context.scene.golem_settings, "failed")
+        row.enabled = progress_btn
+        row = colr.row()
+        row.prop(bpy.context.scene.golem_settings, "frames_per_minute")
+        row.prop(bpy.context.scene.golem_settings, "eta")
+        row.enabled = progress_btn
+        row = colr.row()
+        row.prop(bpy.context.scene.golem_settings, "spent")
+        row.enabled = progress_btn
+        row = colr.row()
+        row.prop(bpy.context.scene.golem_settings, "estimated_cost")
+        row.prop(bpy.context.scene.golem_settings, "estimated_time")
+        row.enabled = False
+        if progress_btn and progress_model is not None:
+            for name, rate in progress_model.provider_rates():
+                colr.label(text=name + ": " + str(round(rate, 2)) + " frames/min")
 
 def register():
     try:
@@ -359,17 +635,27 @@ def register():
             ensurepip.bootstrap()
         subprocess.run([sys.executable, "-m", "pip", "install", "yapapi"], check=True)
 
+    try:
+        import OpenImageIO
+    except:
+        subprocess.run([sys.executable, "-m", "pip", "install", "OpenImageIO"])
+
     bpy.utils.register_class(GolemRenderSettings)
     bpy.utils.register_class(Golem_Render)
+    bpy.utils.register_class(Golem_Resume)
     bpy.utils.register_class(Golem_Cancel)
     bpy.utils.register_class(LayoutDemoPanel)
     bpy.types.Scene.golem_settings = bpy.props.PointerProperty(type=GolemRenderSettings)
 
     bpy.app.handlers.load_post.append(init)
+    atexit.register(stop_daemon)
 
 def unregister():
+    atexit.unregister(stop_daemon)
+    stop_daemon()
     bpy.utils.unregister_class(LayoutDemoPanel)
     bpy.utils.unregister_class(Golem_Render)
+    bpy.utils.unregister_class(Golem_Resume)
     bpy.utils.unregister_class(Golem_Cancel)
     bpy.utils.unregister_class(GolemRenderSettings)
     del bpy.types.Scene.golem_settings
@@ -11,11 +11,61 @@ import json
 import asyncio
 import tempfile
 import importlib
+import shlex
+import re
+import uuid
 from pathlib import Path
 from datetime import datetime, timedelta
 from tempfile import TemporaryDirectory
 from multiprocessing import Process, Value, Queue
 from decimal import Decimal
+from collections import deque
+
+from packer import list_directory, pack_project, chunk_archive, write_chunk_list
+from scheduler import FrameScheduler, frames_argument, MAX_CHUNK
+from provider_history import ProviderHistory
+from timeouts import AdaptiveTimeouts
+from job_manifest import output_extension, mark_completed, load_job
+from cost_estimate import estimate_costs
+from output_transfer import BUNDLE_DIRECTORY, encoding_overrides, bundle_name, bundle_command, extract_bundle, TransferStats
+from frame_check import FrameChecks
+from previews import Previews
+from telemetry import Telemetry, ProviderAdded, ProviderRemoved, UploadFinished, ChunkStarted, ChunkRendered, DownloadFinished, FramesFinished, FrameRejected, PaymentDue, PaymentAccepted, Estimate, JobFailed
+from frame_split import unit_frame, unit_suffix, overrides_expression, tile_regions, tile_overrides, stitch_tiles, sample_overrides, merge_samples, save_as_render, remove_parts
+
+# Runs queued render requests one after the other on the provider, so that the next chunk can render
+# while the previous one is downloading. On a provider with several GPUs one runner per GPU claims
+# requests by renaming them. <id>.started gets the provider's clock when the request is claimed and
+# when it is done: with several lanes, requests are not done in the order the requestor waits for them.
+QUEUE_RUNNER = """cd /golem/resources/.queue
+while [ ! -e stop ]; do
+    r=$(ls *.request 2>/dev/null | head -n 1)
+    if [ -z "$r" ]; then sleep 0.2; continue; fi
+    id=${r%.request}
+    mv $r $id.running || continue
+    date +%s.%N > $id.started
+    sh $id.running > $id.log 2>&1
+    echo $? > $id.status && date +%s.%N >> $id.started && mv $id.status $id.done
+done
+"""
+
+# Seconds a finished job waits for the invoices of its agreements, which come after the agreements end.
+INVOICE_TIMEOUT = 180
+
+def lane_count(gpus, properties, memory, threads):
+    # One render lane per GPU, as far as the provider's memory and threads go at the size asked per lane.
+    lanes = max(1, gpus)
+    offered_memory = properties.get("golem.inf.mem.gib")
+    if offered_memory and memory:
+        lanes = min(lanes, int(offered_memory // memory))
+    offered_threads = properties.get("golem.inf.cpu.threads")
+    if offered_threads and threads:
+        lanes = min(lanes, int(offered_threads // threads))
+    return max(1, lanes)
+
+def lane_launch(command, lanes, name):
+    # Starts `command` in the background once per lane, pinned to its GPU, with name<lane>.log/.pid.
+    return " && ".join("(CUDA_VISIBLE_DEVICES=" + str(lane) + " nohup " + command.replace("{lane}", str(lane)) + " > " + name + str(lane) + ".log 2>&1 < /dev/null & echo $! > " + name + str(lane) + ".pid)" for lane in range(lanes))
 
 def init_payment(queue, network):
     cmd = ["yagna", "payment", "init", "--sender", "--network=" + network, "--driver=erc20"]
@@ -23,10 +73,12 @@ def init_payment(queue, network):
         with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
             for line in proc.stderr:
                 if "Error: Called service `/local/identity/Get` is unavailable" in line:
-                    queue.put('yagna_not_started')
+                    queue.put(JobFailed('yagna_not_started'))
+                    return False
     except:
-        queue.put('yagna_not_installed')
-        return
+        queue.put(JobFailed('yagna_not_installed'))
+        return False
+    return True
 
 def get_appkey():
     cmd = ["yagna", "app-key", "list", "--json"]
@@ -36,43 +88,84 @@ def get_appkey():
             json_key_list += line.strip()
     return json.loads(json_key_list)[0]['key']
 
-async def main( queue=None,
-                payment_driver=None,
-                payment_network=None,
-                subnet_tag=None,
-                budget=None,
-                interval_payment=0,
-                start_price=0,
-                cpu_price=0,
-                env_price=0,
-                timeout_global=0,
-                timeout_upload=0,
-                timeout_render=0,
-                workers=0,
-                memory=0,
-                storage=0,
-                threads=0,
-                format=None,
-                scene=None,
-                frames=None,
-                output_dir=None,
-                project_directory=None):
-
-    from yapapi import Golem, Task, WorkContext
+class JobEventRouter:
+    # The one event consumer of an engine shared by several jobs: hands each job's events to the handler
+    # the job registered, for as long as it is registered.
+    def __init__(self):
+        self.handlers = {}
+
+    def add(self, job_id, handler):
+        self.handlers[job_id] = handler
+
+    def remove(self, job_id):
+        self.handlers.pop(job_id, None)
+
+    def __call__(self, event):
+        handler = self.handlers.get(event.job.id)
+        if handler is not None:
+            handler(event)
+
+async def run_job(golem,
+                  router,
+                  queue=None,
+                  budget=None,
+                  job_id=None,
+                  start_price=0,
+                  cpu_price=0,
+                  env_price=0,
+                  timeout_global=0,
+                  timeout_upload=0,
+                  timeout_render=0,
+                  workers=0,
+                  memory=0,
+                  storage=0,
+                  threads=0,
+                  format=None,
+                  scene=None,
+                  frames=None,
+                  output_dir=None,
+                  project_directory=None,
+                  project_files=None,
+                  engine="COMMAND",
+                  pipeline_depth=1,
+                  split_mode="NONE",
+                  split_parts=1,
+                  resolution=None,
+                  samples=0,
+                  blender_binary="blender",
+                  history_file=None,
+                  selection="PRICE",
+                  deadline=0,
+                  timeout_percentile=95,
+                  timeout_margin=2.0,
+                  estimate_every=0,
+                  transfer="FILES",
+                  exr_codec=None,
+                  png_compression=None,
+                  check_frames=True,
+                  contact_sheet=False,
+                  preview_movie=False,
+                  preview_fps=24):
+
+    from yapapi import Task, WorkContext
     from yapapi.payload import vm
     from yapapi.rest.activity import BatchTimeoutError
-    from yapapi.events import AgreementConfirmed, TaskAccepted, ActivityCreateFailed, TaskRejected, WorkerFinished, TaskRejected
+    from yapapi.events import AgreementConfirmed, TaskAccepted, ActivityCreateFailed, TaskRejected, WorkerFinished
     from yapapi import events
     from yapapi.strategy import LeastExpensiveLinearPayuMS
     from yapapi.contrib.strategy import ProviderFilter
     from yapapi.props import com
+    from market import HistoryMarketStrategy, ThroughputMarketStrategy
 
     bad_providers = set()
+    # Agreements of the job without an accepted invoice: history and telemetry stay open until they are paid.
+    unpaid_agreements = set()
+    agreements_paid = asyncio.Event()
+    agreements_paid.set()
+    # The engine may outlive this job: its events come through the engine's router, by job id.
+    job_id = job_id or str(uuid.uuid4())
 
-    if format in ["OPEN_EXR_MULTILAYER", "OPEN_EXR"]:
-        ext = "exr"
-    else:
-        ext = format.lower()
+    ext = output_extension(format)
 
     package = await vm.repo(
         image_hash = "b5e19a68e0268c0e72309048b5e6a29512e3ecbabd355c6ac590f75d",
@@ -82,134 +175,512 @@ async def main( queue=None,
         capabilities = ["cuda"],
     )
 
-    input_file = output_dir + "/archive.zip"
-    with zipfile.ZipFile(input_file, 'w') as f:
-        for subdir, dirs, files in os.walk(project_directory):
-                for file in files:
-                    srcpath = os.path.join(subdir, file)
-                    dstpath_in_zip = os.path.relpath(srcpath, start=project_directory)
-                    with open(srcpath, 'rb') as infile:
-                        f.writestr(dstpath_in_zip, infile.read())
+    cache_directory = os.path.join(os.path.dirname(output_dir), ".golem_cache")
+    os.makedirs(cache_directory, exist_ok=True)
+    input_file, archive_manifest = pack_project(project_files or list_directory(project_directory, exclude=[cache_directory, output_dir]), cache_directory + "/" + scene + ".zip")
+    print('Archive ' + input_file + ' ready (' + str(archive_manifest['archive_size']) + ' bytes)')
+    render_server_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_server.py")
+    queue_directory = "/golem/resources/.queue"
+
+    # Parts of split frames are rendered losslessly when the output is JPEG, and encoded once assembled.
+    # Sample parts are linear float EXR so that they can be averaged.
+    if split_mode == "SAMPLES":
+        part_format = "OPEN_EXR_MULTILAYER" if format == "OPEN_EXR_MULTILAYER" else "OPEN_EXR"
+        part_ext = "exr"
+    else:
+        part_format = "PNG" if format == "JPEG" else format
+        part_ext = "png" if format == "JPEG" else ext
+    parts_directory = output_dir + "/.parts"
+    transfer_directory = output_dir + "/.transfer"
+    frame_overrides = encoding_overrides(format, exr_codec, png_compression)
+    if transfer != "FILES":
+        os.makedirs(transfer_directory, exist_ok=True)
+    parts_done = {}
+    assembled = set()
+    parts_per_frame = split_parts if split_mode in ["TILES", "SAMPLES"] else 1
+    if parts_per_frame > 1:
+        width, height = resolution
+        if split_mode == "TILES":
+            regions = tile_regions(split_parts, width, height)
+            parts_per_frame = len(regions)
+        kind = "tile" if split_mode == "TILES" else "sample"
+        units = [(frame, kind, index) for frame in frames for index in range(parts_per_frame)]
+        os.makedirs(parts_directory, exist_ok=True)
+    else:
+        units = list(frames)
+    history = ProviderHistory(history_file) if history_file else ProviderHistory()
+    telemetry = Telemetry(output_dir, queue)
+    timeouts = AdaptiveTimeouts(timeout_upload * 60, timeout_render * 60, timeout_percentile, timeout_margin)
+    history_scene = scene if parts_per_frame == 1 else scene + "/" + units[0][1] + str(parts_per_frame)
+
+    def unit_output(unit):
+        if isinstance(unit, int):
+            return f"{unit:04d}.{ext}"
+        return f"{unit[0]:04d}{unit_suffix(unit)}.{part_ext}"
+
+    def unit_local_path(unit):
+        if isinstance(unit, int):
+            return f"{output_dir}/{unit:04d}.{ext}"
+        return parts_directory + "/" + unit_output(unit)
+
+    def unit_size(unit):
+        # Expected size of a unit's image, with a pixel of tolerance for the crop of tiles.
+        if resolution is None:
+            return None, 0
+        if isinstance(unit, int) or unit[1] == "sample":
+            return resolution, 0
+        xmin, xmax, ymin, ymax = regions[unit[2]]
+        return (xmax - xmin, ymax - ymin), 1
+
+    def check_units(done, task_id):
+        return {unit: frame_checks.check(unit, unit_local_path(unit) + "." + task_id, *unit_size(unit)) for unit in done}
+
+    def unit_overrides(unit):
+        if unit[1] == "tile":
+            return tile_overrides(regions[unit[2]], width, height)
+        return sample_overrides(unit[2], parts_per_frame, samples)
+
+    def render_command(chunk):
+        if isinstance(chunk[0], int):
+            encoding = " --python-expr " + shlex.quote(overrides_expression(frame_overrides)) if frame_overrides else ""
+            return "DISPLAY=:1 blender -b /golem/resources/" + scene + ".blend -o /golem/output/ -noaudio -F " + format + encoding + " " + frames_argument(chunk) + " -- --cycles-device CUDA"
+        unit = chunk[0]
+        return "DISPLAY=:1 blender -b /golem/resources/" + scene + ".blend -o /golem/output/####" + unit_suffix(unit) + " -noaudio -F " + part_format + " --python-expr " + shlex.quote(overrides_expression(unit_overrides(unit))) + " -f " + str(unit[0]) + " -- --cycles-device CUDA"
+
+    def server_request(chunk):
+        renders = []
+        for unit in chunk:
+            if isinstance(unit, int):
+                renders.append({'frame': unit, 'output': "/golem/output/", 'format': format, 'overrides': frame_overrides})
+            else:
+                renders.append({'frame': unit[0], 'output': "/golem/output/####" + unit_suffix(unit), 'format': part_format, 'overrides': unit_overrides(unit)})
+        return json.dumps({'renders': renders})
+
+    def merge(frame, paths):
+        output_file = f"{output_dir}/{frame:04d}.{ext}"
+        if ext == "exr":
+            merge_samples(paths, output_file)
+            return
+        merged_file = parts_directory + f"/{frame:04d}_merged.exr"
+        merge_samples(paths, merged_file)
+        save_as_render(blender_binary, project_directory + "/" + scene + ".blend", merged_file, output_file, format)
+        remove_parts([merged_file])
+
+    async def assemble(frame):
+        parts = [unit for unit in units if not isinstance(unit, int) and unit[0] == frame]
+        paths = [unit_local_path(unit) for unit in parts]
+        loop = asyncio.get_event_loop()
+        if split_mode == "TILES":
+            tiles = [(unit_local_path(unit), regions[unit[2]]) for unit in parts]
+            await loop.run_in_executor(None, stitch_tiles, tiles, width, height, f"{output_dir}/{frame:04d}.{ext}")
+        else:
+            await loop.run_in_executor(None, merge, frame, paths)
+        remove_parts(paths)
+
+    async def complete_units(done):
+        completed_frames = []
+        for unit in done:
+            if isinstance(unit, int):
+                completed_frames.append(unit)
+                continue
+            frame = unit[0]
+            parts_done.setdefault(frame, set()).add(unit)
+            if len(parts_done[frame]) == parts_per_frame and frame not in assembled:
+                assembled.add(frame)
+                try:
+                    await assemble(frame)
+                except Exception as e:
+                    print('Cannot assemble frame ' + str(frame) + ', its parts are kept in ' + parts_directory + ': ' + str(e))
+                completed_frames.append(frame)
+        return completed_frames
+
+    chunk_directory = cache_directory + "/chunks"
+    archive_chunks = chunk_archive(input_file, archive_manifest, chunk_directory)
+    chunk_list_file = write_chunk_list(archive_chunks, cache_directory + "/" + scene + ".chunks")
 
     def event_consumer(event: events.Event):
-        if isinstance(event, events.AgreementConfirmed):
+        if isinstance(event, events.SubscriptionCreated):
+            golem.strategy.subscribed(job_id, event.subscription.id)
+        elif isinstance(event, events.AgreementConfirmed):
             print('AgreementConfirmed ' + event.provider_id)
-            queue.put('add_provider')
-        elif isinstance(event, (events.ActivityCreateFailed, events.TaskRejected, events.WorkerFinished, events.TaskRejected)):
+            unpaid_agreements.add(event.agreement.id)
+            agreements_paid.clear()
+            telemetry.emit(ProviderAdded(event.provider_id, event.provider_info.name))
+        elif isinstance(event, (events.ActivityCreateFailed, events.TaskRejected, events.WorkerFinished)):
+            if isinstance(event, events.ActivityCreateFailed):
+                history.record_task(event.provider_id, failed=True)
             bad_providers.add(event.provider_id)
-            queue.put('remove_provider')
+            telemetry.emit(ProviderRemoved(event.provider_id, event.provider_info.name, type(event).__name__))
         elif isinstance(event, events.TaskAccepted):
             print('Task data ' + str(event.task.data) + ' accepted from provider ' + event.agreement.details.provider_node_info.name)
-            queue.put('frame_finished')
+            if event.result:
+                telemetry.emit(FramesFinished(event.provider_id, event.provider_info.name, list(event.result)))
+        elif isinstance(event, events.InvoiceAccepted):
+            history.record_cost(event.provider_id, float(event.amount))
+            telemetry.emit(PaymentAccepted(event.provider_id, event.provider_info.name, event.agreement.id, float(event.amount)))
+        elif isinstance(event, events.DebitNoteAccepted):
+            telemetry.emit(PaymentDue(event.provider_id, event.provider_info.name, event.agreement.id, float(event.debit_note.total_amount_due)))
+        if isinstance(event, (events.InvoiceAccepted, events.PaymentFailed)):
+            if isinstance(event, events.PaymentFailed):
+                print('Payment to ' + event.provider_info.name + ' failed')
+            unpaid_agreements.discard(event.agreement.id)
+            if not unpaid_agreements:
+                agreements_paid.set()
 
     async def worker(ctx: WorkContext, tasks):
-        script = ctx.new_script(timeout=timedelta(minutes=(timeout_upload + timeout_render)))
-        script.upload_file(input_file, "/golem/resources/archive.zip");
+        known_upload_rate = (history.stats(ctx.provider_id) or {}).get('upload_rate')
+        in_flight = deque()
+        # The chunk out of in_flight being downloaded and checked.
+        finishing = None
+        script = ctx.new_script(timeout=timedelta(seconds=timeouts.upload(0)))
+        future_chunks = script.run("/bin/sh", "-c", "mkdir -p /golem/resources/chunks && ls /golem/resources/chunks")
 
         try:
+            yield script
+            stored_chunks = set(((await future_chunks).stdout or '').split())
+
+            missing_chunks = {chunk['hash']: chunk['size'] for chunk in archive_chunks if chunk['hash'] not in stored_chunks}
+            script = ctx.new_script(timeout=timedelta(seconds=timeouts.upload(sum(missing_chunks.values()), known_upload_rate)))
+            for chunk_hash in missing_chunks:
+                script.upload_file(chunk_directory + "/" + chunk_hash, "/golem/resources/chunks/" + chunk_hash)
+            script.upload_file(chunk_list_file, "/golem/resources/archive.chunks")
+            print('Uploading ' + str(sum(missing_chunks.values())) + '/' + str(archive_manifest['archive_size']) + ' bytes to provider ' + ctx.provider_name)
+
             script.run("/bin/sh", "-c", "(rm -rf /golem/output/*) || true")
-            script.run("/bin/sh", "-c", "unzip -o /golem/resources/archive.zip -d /golem/resources/")
-            cmd_display = "PCIID=$(nvidia-xconfig --query-gpu-info | grep 'PCI BusID' | awk -F'PCI BusID : ' '{print $2}') && (nvidia-xconfig --busid=$PCIID --use-display-device=none --virtual=1280x1024 || true) && ((Xorg :1 &) || true) && sleep 5"
-            script.run("/bin/sh", "-c", cmd_display)
+            cmd_verify = "cd /golem/resources/chunks && (for h in " + " ".join(missing_chunks) + "; do echo \"$h  $h\"; done) | sha256sum -c --quiet || (rm -f " + " ".join(missing_chunks) + " && false)"
+            if missing_chunks:
+                script.run("/bin/sh", "-c", cmd_verify)
+            upload_started = time.monotonic()
+            yield script
+            if missing_chunks:
+                history.record_upload(ctx.provider_id, sum(missing_chunks.values()), time.monotonic() - upload_started)
+                timeouts.record_upload(sum(missing_chunks.values()), time.monotonic() - upload_started)
+                telemetry.emit(UploadFinished(ctx.provider_id, ctx.provider_name, sum(missing_chunks.values()), time.monotonic() - upload_started))
 
-            async for task in tasks:
-                frame = task.data
-                cmd_render = "(DISPLAY=:1 blender -b /golem/resources/" + scene + ".blend -o /golem/output/ -noaudio -F " + format + " -f " + str(frame) + " -- --cycles-device CUDA) || true"
-                script.run("/bin/sh", "-c", cmd_render)
-                output_file = f"{output_dir}/{frame:04d}.{ext}"
-                future_result = script.download_file(f"/golem/output/{frame:04d}.{ext}", output_file)
+            script = ctx.new_script(timeout=timedelta(seconds=timeouts.upload(archive_manifest['archive_size'], known_upload_rate)))
+            cmd_rebuild = "cd /golem/resources && sed 's|^|chunks/|' archive.chunks | xargs cat > archive.zip && unzip -o archive.zip -d /golem/resources/ && rm archive.zip"
+            script.run("/bin/sh", "-c", cmd_rebuild)
+            cmd_display = "PCIID=$(nvidia-xconfig --query-gpu-info | grep 'PCI BusID' | awk -F'PCI BusID : ' '{print $2}' | head -n 1) && (nvidia-xconfig --busid=$PCIID --use-display-device=none --virtual=1280x1024 || true) && ((Xorg :1 &) || true) && sleep 5; echo gpus $(nvidia-smi -L 2>/dev/null | grep -c '^GPU')"
+            future_display = script.run("/bin/sh", "-c", cmd_display)
+            yield script
+            gpus = re.search(r"gpus (\d+)", (await future_display).stdout or '')
+            lanes = lane_count(int(gpus.group(1)) if gpus else 1, ctx._agreement_details.provider_view.properties, memory, threads)
+            if lanes > 1:
+                print('Provider ' + ctx.provider_name + ': rendering on ' + str(lanes) + ' GPUs')
 
+            # queue_pid: the pid files of the processes rendering the queued requests, one per lane.
+            queue_pid = None
+            script = ctx.new_script(timeout=timedelta(minutes=timeout_render))
+            script.run("/bin/sh", "-c", "mkdir -p " + queue_directory + " && rm -f " + queue_directory + "/*")
+            if engine == "SERVER":
+                script.upload_file(render_server_file, "/golem/resources/.golem_render_server.py")
+                cmd_server = "cd " + queue_directory + " && " + lane_launch("env DISPLAY=:1 blender -b /golem/resources/" + scene + ".blend -noaudio -P /golem/resources/.golem_render_server.py -- --cycles-device CUDA --server-dir " + queue_directory + " --ready-file ready{lane} --output /golem/output/ --format " + format, lanes, "server")
+                for lane in range(lanes):
+                    cmd_server += "; while [ ! -e ready" + str(lane) + " ]; do kill -0 $(cat server" + str(lane) + ".pid) 2>/dev/null || break; sleep 0.5; done; ([ -e ready" + str(lane) + " ] && echo ready" + str(lane) + ") || rm -f server" + str(lane) + ".pid"
+                future_server = script.run("/bin/sh", "-c", cmd_server)
+                yield script
+                ready_lanes = ((await future_server).stdout or '').count("ready")
+                if ready_lanes:
+                    queue_pid = queue_directory + "/server*.pid"
+                    lanes = ready_lanes
+                else:
+                    print('Render server failed to start on provider ' + ctx.provider_name + ', using one blender process per chunk')
+                script = ctx.new_script(timeout=timedelta(minutes=timeout_render))
+            if queue_pid is None and (pipeline_depth > 1 or lanes > 1):
+                script.upload_bytes(QUEUE_RUNNER.encode(), "/golem/resources/.golem_queue_runner.sh")
+                script.run("/bin/sh", "-c", "cd " + queue_directory + " && " + lane_launch("sh /golem/resources/.golem_queue_runner.sh", lanes, "runner"))
                 yield script
-                result = await future_result
+                queue_pid = queue_directory + "/runner*.pid"
 
-                if result.success:
-                    task.accept_result(result=f"{frame:04d}")
+            async def next_task(prefetch):
+                # Without a chunk in flight the provider is idle: straggling chunks can be duplicated for it.
+                if prefetch:
+                    scheduler.prefetch_started()
                 else:
-                    task.reject_result(reason="bad result", retry=True)
+                    scheduler.idle_started(ctx.provider_id)
+                try:
+                    return await tasks.__anext__()
+                except StopAsyncIteration:
+                    return None
+                finally:
+                    if prefetch:
+                        scheduler.prefetch_finished()
+                    else:
+                        scheduler.idle_finished(ctx.provider_id)
 
-                script = ctx.new_script(timeout=timedelta(minutes=timeout_render))
+            sequence = 0
+            more_tasks = True
+            hidden_download_seconds = 0
+            while True:
+                depth = pipeline_depth * lanes if queue_pid else 1
+                script = None
+                while more_tasks and len(in_flight) < depth:
+                    task = await next_task(prefetch=bool(in_flight))
+                    if task is None:
+                        more_tasks = False
+                        break
+                    if not task.data:
+                        task.accept_result(result=[])
+                        break
+                    if not scheduler.fresh(task.data):
+                        task.accept_result(result=[])
+                        continue
+                    if scheduler.owned(task.data, ctx.provider_id):
+                        # yapapi's queue hands tasks out to whichever worker asks: a duplicate of this provider's
+                        # own chunk goes back for another one.
+                        scheduler.decline(task.data)
+                        task.accept_result(result=[])
+                        continue
+                    sequence += 1
+                    request = queue_directory + "/r" + f"{sequence:06d}"
+                    in_flight.append((task, request))
+                    telemetry.emit(ChunkStarted(ctx.provider_id, ctx.provider_name, len(task.data)))
+                    if len(in_flight) == 1:
+                        scheduler.start(task.id, task.data, ctx.provider_id)
+                    if queue_pid:
+                        script = script or ctx.new_script(timeout=timedelta(seconds=timeouts.render(in_flight[0][0].data, scheduler.unit_times[-100:], scheduler.work(in_flight[0][0].data))))
+                        if queue_pid.endswith("server*.pid"):
+                            content = server_request(task.data)
+                        else:
+                            content = render_command(task.data)
+                        script.upload_bytes(content.encode(), request + ".tmp")
+                        script.run("/bin/sh", "-c", "mv " + request + ".tmp " + request + ".request")
+
+                if not in_flight:
+                    if more_tasks:
+                        continue
+                    break
+
+                task, request = in_flight[0]
+                chunk = task.data
+                script = script or ctx.new_script(timeout=timedelta(seconds=timeouts.render(chunk, scheduler.unit_times[-100:], scheduler.work(chunk))))
+                if queue_pid:
+                    # The queue is down as soon as one lane is: its claimed request would never be done.
+                    cmd_wait = "while [ ! -e " + request + ".done ]; do if ! kill -0 $(cat " + queue_pid + ") 2>/dev/null; then echo queue_down; break; fi; sleep 0.2; done; "
+                    # How long the request rendered, from its lane's clock.
+                    cmd_wait += "awk 'NR == 1 {started = $1} NR == 2 {print \"rendered\", $1 - started}' " + request + ".started 2>/dev/null; ls /golem/output"
+                    future_outputs = script.run("/bin/sh", "-c", cmd_wait)
+                else:
+                    script.run("/bin/sh", "-c", "(rm -rf /golem/output/*) || true")
+                    script.run("/bin/sh", "-c", "(" + render_command(chunk) + ") || true")
+                    future_outputs = script.run("/bin/sh", "-c", "ls /golem/output")
+                yield script
+
+                stdout = (await future_outputs).stdout or ''
+                outputs = set(stdout.split())
+                rendered = re.search(r"^rendered (\S+)$", stdout, re.M)
+                if rendered:
+                    render_seconds = float(rendered.group(1))
+                else:
+                    render_seconds = time.monotonic() - scheduler.started_at.get(task.id, time.monotonic())
+                in_flight.popleft()
+                finishing = task
+                if in_flight:
+                    scheduler.start(in_flight[0][0].id, in_flight[0][0].data, ctx.provider_id)
+                queue_stopped = "queue_down" in outputs
+                if queue_stopped:
+                    print('Render queue stopped on provider ' + ctx.provider_name + ', using one blender process per chunk')
+                    queue_pid = None
+                    # The frames go back to the scheduler. Not rejected: TaskRejected would ban a provider that
+                    # carries on rendering.
+                    while len(in_flight) > 0:
+                        queued_task, queued_request = in_flight.pop()
+                        scheduler.finish(queued_task.id, [], queued_task.data)
+                        telemetry.emit(ChunkRendered(ctx.provider_id, ctx.provider_name, len(queued_task.data), len(queued_task.data), 0))
+                        queued_task.accept_result(result=[])
 
-        except BatchTimeoutError:
-            bad_providers.add(ctx.provider_id)
-            queue.put('remove_provider')
+                done = [unit for unit in chunk if unit_output(unit) in outputs]
+                failed = [unit for unit in chunk if unit not in done]
+                telemetry.emit(ChunkRendered(ctx.provider_id, ctx.provider_name, len(chunk), len(failed), render_seconds))
+                if done:
+                    script = ctx.new_script(timeout=timedelta(minutes=timeout_upload))
+                    if transfer == "FILES":
+                        for unit in done:
+                            script.download_file("/golem/output/" + unit_output(unit), unit_local_path(unit) + "." + task.id)
+                        if queue_pid:
+                            script.run("/bin/sh", "-c", "cd /golem/output && rm -f " + " ".join(unit_output(unit) for unit in done))
+                    else:
+                        bundle = bundle_name(task.id, transfer)
+                        script.run("/bin/sh", "-c", bundle_command([unit_output(unit) for unit in done], bundle, transfer))
+                        script.download_file(BUNDLE_DIRECTORY + "/" + bundle, transfer_directory + "/" + bundle)
+                        script.run("/bin/sh", "-c", "rm -f " + BUNDLE_DIRECTORY + "/" + bundle)
+                    download_started = time.monotonic()
+                    yield script
+                    download_seconds = time.monotonic() - download_started
+                    if in_flight:
+                        hidden_download_seconds += download_seconds
+                    if transfer == "FILES":
+                        download_size = sum(os.path.getsize(unit_local_path(unit) + "." + task.id) for unit in done)
+                        raw_size = download_size
+                    else:
+                        download_size = os.path.getsize(transfer_directory + "/" + bundle)
+                        destinations = {unit_output(unit): unit_local_path(unit) + "." + task.id for unit in done}
+                        raw_size = await asyncio.get_event_loop().run_in_executor(None, extract_bundle, transfer_directory + "/" + bundle, destinations)
+                        # A frame missing from the bundle is rendered again.
+                        missing = [unit for unit in done if not os.path.exists(destinations[unit_output(unit)])]
+                        done = [unit for unit in done if unit not in missing]
+                        failed += missing
+                    transfer_stats.record(download_size, raw_size, download_seconds, len(done))
+                    telemetry.emit(DownloadFinished(ctx.provider_id, ctx.provider_name, download_size, download_seconds))
+                if done and check_frames:
+                    # Blender's exit status is ignored: a bad image is rendered again instead of being kept.
+                    reasons = await asyncio.get_event_loop().run_in_executor(None, check_units, done, task.id)
+                    rejected = [unit for unit in done if reasons[unit]]
+                    for unit in rejected:
+                        print('Provider ' + ctx.provider_name + ': ' + str(unit) + ' rejected (' + reasons[unit] + ')')
+                        telemetry.emit(FrameRejected(ctx.provider_id, ctx.provider_name, unit_frame(unit), reasons[unit]))
+                        remove_parts([unit_local_path(unit) + "." + task.id])
+                    done = [unit for unit in done if unit not in rejected]
+                    failed += rejected
+                # A duplicated chunk may have been completed by the other provider in the meantime.
+                fresh = scheduler.fresh(done)
+                frame_time = scheduler.finish(task.id, done, failed, render_seconds)
+                for unit in done:
+                    if unit in fresh:
+                        os.replace(unit_local_path(unit) + "." + task.id, unit_local_path(unit))
+                    else:
+                        remove_parts([unit_local_path(unit) + "." + task.id])
+                if frame_time is not None:
+                    history.record_frames(ctx.provider_id, history_scene, len(done), frame_time * len(done))
+                    speculation_stats['discarded_seconds'] += frame_time * (len(done) - len(fresh))
+                history.record_task(ctx.provider_id, failed=not done, name=ctx.provider_name)
+
+                if done:
+                    task.accept_result(result=await complete_units(fresh))
+                elif queue_stopped:
+                    task.accept_result(result=[])
+                else:
+                    task.reject_result(reason="bad result", retry=False)
+                finishing = None
+
+            if hidden_download_seconds:
+                print('Provider ' + ctx.provider_name + ': ' + str(round(hidden_download_seconds)) + 's of downloads overlapped with rendering (GPU idle time saved)')
+                pipeline_stats['hidden_download_seconds'] += hidden_download_seconds
+
+        except Exception as e:
+            if isinstance(e, BatchTimeoutError):
+                if in_flight:
+                    timeouts.render_timed_out(in_flight[0][0].data)
+                history.record_timeout(ctx.provider_id)
+                bad_providers.add(ctx.provider_id)
+                telemetry.emit(ProviderRemoved(ctx.provider_id, ctx.provider_name, "timeout"))
+            # Whatever stopped the worker, its unfinished chunks go back to the scheduler. They are closed
+            # here, not left to yapapi to retry: their frames would be rendered twice.
+            for queued_task, queued_request in in_flight:
+                telemetry.emit(ChunkRendered(ctx.provider_id, ctx.provider_name, len(queued_task.data), len(queued_task.data), 0))
+            for unfinished in [queued_task for queued_task, queued_request in in_flight] + ([finishing] if finishing else []):
+                scheduler.finish(unfinished.id, [], unfinished.data)
+                unfinished.accept_result(result=[])
             raise
 
-    golem = Golem(
-        budget=budget,
-        subnet_tag=subnet_tag,
-        payment_driver=payment_driver,
-        payment_network=payment_network,
-    )
+    costs = None
+    if estimate_every:
+        costs = await asyncio.get_event_loop().run_in_executor(None, estimate_costs, blender_binary, project_directory + "/" + scene + ".blend", frames, estimate_every)
+    scheduler = FrameScheduler(units, workers, max_chunk=(1 if parts_per_frame > 1 else MAX_CHUNK), costs=costs)
+    pipeline_stats = {'hidden_download_seconds': 0}
+    transfer_stats = TransferStats()
+    frame_checks = FrameChecks()
+    previews = None
+    if contact_sheet or preview_movie:
+        # The whole shot, also the frames rendered before the job was resumed.
+        job = load_job(output_dir)
+        shot = job['frames'] if job is not None else list(frames)
+        previews = Previews(output_dir, shot, lambda frame: f"{output_dir}/{frame:04d}.{ext}", contact_sheet, preview_movie, preview_fps)
+        pending = set(frames)
+        previews.add([frame for frame in shot if frame not in pending])
+    speculation_stats = {'discarded_seconds': 0}
+    estimate_stats = {'reported_at': 0}
 
-    golem.strategy = ProviderFilter(LeastExpensiveLinearPayuMS(
+    def report_estimate(cost, seconds):
+        if time.monotonic() - estimate_stats['reported_at'] < 5:
+            return
+        estimate_stats['reported_at'] = time.monotonic()
+        print('Estimate with the best offers so far: ' + str(round(cost, 4)) + ' GLM, ' + str(timedelta(seconds=int(seconds))))
+        telemetry.emit(Estimate(cost, int(seconds)))
+
+    price_strategy = LeastExpensiveLinearPayuMS(
         max_fixed_price=Decimal(str(start_price)),
         max_price_for={
             com.Counter.CPU: Decimal(str(cpu_price)),
             com.Counter.TIME: Decimal(str(env_price))
         }
-    ), lambda provider_id: provider_id not in bad_providers)
-
-    async with golem:
-        golem.add_event_consumer(event_consumer)
+    )
+    if selection == "PRICE":
+        strategy = HistoryMarketStrategy(price_strategy, history)
+    else:
+        strategy = ThroughputMarketStrategy(price_strategy, history, history_scene, len(units), workers, budget,
+            deadline = (deadline * 3600 if selection == "DEADLINE" else None),
+            frame_time = scheduler.frame_time,
+            on_estimate = report_estimate,
+            remaining = lambda: len(scheduler.pending) + len(scheduler.outstanding))
+    golem.strategy.use(job_id, ProviderFilter(strategy, lambda provider_id: provider_id not in bad_providers))
+    router.add(job_id, event_consumer)
 
-        completed_tasks = golem.execute_tasks(
-            worker,
-            [Task(data=frame) for frame in frames],
-            payload=package,
-            max_workers=workers,
-            timeout=timedelta(hours=timeout_global)
-        )
+    completed_tasks = golem.execute_tasks(
+        worker,
+        scheduler.tasks(lambda chunk: Task(data=chunk)),
+        payload=package,
+        max_workers=workers,
+        timeout=timedelta(hours=timeout_global),
+        job_id=job_id
+    )
 
+    try:
         async for task in completed_tasks:
-            frames.remove(int(task.result))
-
-def render(main_blend_file, project_directory, output_directory, frames, queue, network, budget, start_price, cpu_price, env_price, timeout_global, timeout_upload, timeout_render, workers, memory, storage, threads, format):
+            for frame in task.result:
+                frames.remove(frame)
+            if task.result:
+                mark_completed(output_dir, task.result)
+                if previews is not None:
+                    previews.add(task.result)
+            if not frames and scheduler.speculations:
+                # Every frame is in: stop the losing duplicates instead of waiting for them.
+                break
+    finally:
+        # Also on cancel, so that the job's agreements end while the engine keeps running.
+        try:
+            await completed_tasks.aclose()
+        except asyncio.CancelledError:
+            pass
+        golem.strategy.release(job_id)
+        try:
+            await asyncio.wait_for(agreements_paid.wait(), INVOICE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print('No invoice for ' + str(len(unpaid_agreements)) + ' agreements after ' + str(INVOICE_TIMEOUT) + 's, their costs are not recorded')
+        except asyncio.CancelledError:
+            pass
+        router.remove(job_id)
+        history.close()
+        telemetry.close()
+        if previews is not None:
+            await asyncio.get_event_loop().run_in_executor(None, previews.close)
 
-    importlib.reload(site)
-    from yapapi.log import enable_default_logger
+    if scheduler.speculations:
+        discarded_seconds = speculation_stats['discarded_seconds']
+        print('Speculative re-execution: ' + str(scheduler.speculations) + ' straggling chunks duplicated, ' + str(round(discarded_seconds)) + 's of discarded rendering (at most ' + str(round(discarded_seconds * (cpu_price + env_price), 4)) + ' GLM extra)')
 
-    init_payment(queue, network)
-    app_key = get_appkey()
-    os.environ['YAGNA_APPKEY'] = app_key
+    if pipeline_stats['hidden_download_seconds']:
+        print('Pipelining saved ' + str(round(pipeline_stats['hidden_download_seconds'])) + 's of GPU idle time across providers')
 
-    if platform.system() == "Linux":
-        os.environ['SSL_CERT_FILE'] = "/etc/ssl/certs/ca-certificates.crt"
+    if transfer != "FILES" and transfer_stats.report():
+        print(transfer_stats.report())
 
-    enable_default_logger(
-        log_file=output_directory + '/requestor.log',
-        debug_activity_api=True,
-        debug_market_api=True,
-        debug_payment_api=True,
-        debug_net_api=True,
-    )
+    return frames
 
-    loop = asyncio.get_event_loop()
-    task = loop.create_task(main(
-            queue = queue,
-            payment_driver = "erc20",
-            payment_network = network,
-            subnet_tag = "norbert",
-            budget = budget,
-            interval_payment = 0,
-            start_price = start_price,
-            cpu_price = cpu_price,
-            env_price = env_price,
-            timeout_global = timeout_global,
-            timeout_upload = timeout_upload,
-            timeout_render = timeout_render,
-            workers = workers,
-            memory = memory,
-            storage = storage,
-            threads = threads,
-            format = format,
-            scene = main_blend_file,
-            frames = frames,
-            output_dir = output_directory,
-            project_directory = project_directory
-        ))
+async def main(queue=None, payment_driver=None, payment_network=None, subnet_tag=None, budget=None, interval_payment=0, **job):
+    # One job on its own Golem engine. The render daemon keeps one engine for all its jobs instead.
+    from yapapi import Golem
+    from yapapi.strategy import LeastExpensiveLinearPayuMS
+    from market import SessionMarketStrategy
 
-    try:
-        loop.run_until_complete(task)
-    except:
-        queue.put('insufficient_funds')
-        return
+    golem = Golem(
+        budget=budget,
+        subnet_tag=subnet_tag,
+        payment_driver=payment_driver,
+        payment_network=payment_network,
+        strategy=SessionMarketStrategy(LeastExpensiveLinearPayuMS()),
+    )
+    async with golem:
+        router = JobEventRouter()
+        golem.add_event_consumer(router, ["JobEvent"])
+        await run_job(golem, router, queue=queue, budget=budget, **job)
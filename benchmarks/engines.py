@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from scheduler import frames_argument
+from job_spec import parse_frames
+
+# Compares frames per hour of the two provider engines on the same scene, locally:
+#   python benchmarks/engines.py --blender /path/to/blender --scene scene.blend --frames 1-24
+
+def count_outputs(output, frames):
+    names = os.listdir(output)
+    return sum(1 for frame in frames if any(name.startswith(f"{frame:04d}.") for name in names))
+
+def bench_command(args, frames, output):
+    start = time.monotonic()
+    for i in range(0, len(frames), args.chunk):
+        cmd = [args.blender, "-b", args.scene, "-o", output + "/", "-noaudio", "-F", args.format]
+        cmd += frames_argument(frames[i:i + args.chunk]).split()
+        cmd += ["--", "--cycles-device", args.device]
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - start
+
+def bench_server(args, frames, output):
+    server_dir = tempfile.mkdtemp()
+    start = time.monotonic()
+    cmd = [args.blender, "-b", args.scene, "-noaudio", "-P", os.path.join(ROOT, "render_server.py"), "--",
+           "--cycles-device", args.device, "--server-dir", server_dir, "--output", output + "/", "--format", args.format]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for i in range(0, len(frames), args.chunk):
+            request = os.path.join(server_dir, f"r{i:06d}")
+            renders = [{'frame': frame, 'output': output + "/", 'format': args.format, 'overrides': {}} for frame in frames[i:i + args.chunk]]
+            with open(request + ".tmp", 'w') as f:
+                json.dump({'renders': renders}, f)
+            os.replace(request + ".tmp", request + ".request")
+            while not os.path.exists(request + ".done"):
+                if proc.poll() is not None:
+                    raise RuntimeError("render server exited with code " + str(proc.returncode))
+                time.sleep(0.05)
+        elapsed = time.monotonic() - start
+    finally:
+        open(os.path.join(server_dir, "stop"), 'w').close()
+        proc.wait()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Frames per hour of the command and server render engines")
+    parser.add_argument("--blender", default="blender")
+    parser.add_argument("--scene", required=True)
+    parser.add_argument("--frames", default="1-10")
+    parser.add_argument("--format", default="PNG")
+    parser.add_argument("--device", default="CUDA")
+    parser.add_argument("--chunk", type=int, default=1, help="frames per blender call / server request")
+    args = parser.parse_args()
+    frames = parse_frames(args.frames)
+
+    results = {}
+    for name, bench in (("command", bench_command), ("server", bench_server)):
+        with tempfile.TemporaryDirectory() as output:
+            elapsed = bench(args, frames, output)
+            rendered = count_outputs(output, frames)
+        results[name] = rendered * 3600 / elapsed
+        print(f"{name:8s} {rendered}/{len(frames)} frames in {elapsed:.1f}s, {results[name]:.1f} frames/hour")
+
+    if results["command"]:
+        print(f"server/command speedup: {results['server'] / results['command']:.2f}x")
+
+if __name__ == "__main__":
+    main()
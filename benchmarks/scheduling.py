@@ -0,0 +1,183 @@
+import os
+import sys
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import SimulatedProvider, simulated
+from job_spec import parse_frames
+from frame_check import check_frame
+
+import addon_golem
+
+# Runs addon_golem.main() against a simulated provider fleet, without yagna, GPU or network:
+#   python benchmarks/scheduling.py --frames 1-240 --providers 8 --speed-spread 3 --failure-rate 0.05
+# and reports makespan, frames per hour, GLM spent and GPU idle ratio. With --compare-estimate it also
+# reports the makespan the cost pre-pass saves, e.g. on a shot ending in heavy frames:
+#   python benchmarks/scheduling.py --frames 1-120 --cost-profile spike --compare-estimate
+# and with --compare-transfer what bundled, compressed output downloads save on large frames:
+#   python benchmarks/scheduling.py --output-mb 50 --transfer COMPRESSED --compare-transfer
+
+class Collector:
+    def __init__(self):
+        self.messages = []
+
+    def put(self, message):
+        self.messages.append(message)
+
+def make_fleet(args):
+    rng = random.Random(args.seed)
+    fleet = []
+    for index in range(args.providers):
+        speed = rng.uniform(1, args.speed_spread)
+        fleet.append(SimulatedProvider(
+            "provider-" + str(index),
+            frame_seconds=args.frame_seconds * speed,
+            startup_seconds=args.startup_seconds,
+            upload_rate=rng.uniform(0.5, 2) * args.upload_mbps * 1e6 / 8,
+            download_rate=rng.uniform(0.5, 2) * args.upload_mbps * 1e6 / 8,
+            price_per_hour=args.price * rng.uniform(0.5, 1.5) / speed ** 0.5,
+            failure_rate=args.failure_rate,
+            corrupt_rate=args.corrupt_rate,
+            hang_rate=args.hang_rate,
+            output_size=args.output_mb * 1e6,
+            download_latency=args.download_latency,
+            compress_ratio=args.compress_ratio,
+            gpu="GPU " + str(round(speed, 1)),
+            gpus=args.gpus,
+            seed=rng.randrange(1 << 30)))
+    return fleet
+
+def make_costs(profile, frames):
+    # Relative frame costs of the simulated shot: flat, growing along the shot, or a heavy last tenth
+    # (an explosion at the end).
+    first, last = min(frames), max(frames)
+    if profile == "ramp":
+        return {frame: 0.5 + 2.5 * (frame - first) / max(last - first, 1) for frame in frames}
+    if profile == "spike":
+        return {frame: (5.0 if frame > last - (last - first + 1) / 10 else 1.0) for frame in frames}
+    return {}
+
+def make_project(directory, size):
+    with open(os.path.join(directory, "scene.blend"), 'wb') as f:
+        f.write(os.urandom(size))
+
+def run(args, estimate_every, transfer):
+    fleet = make_fleet(args)
+    frames = parse_frames(args.frames)
+    with tempfile.TemporaryDirectory() as root:
+        project = os.path.join(root, "project")
+        output = os.path.join(root, "output", "job")
+        os.makedirs(project)
+        os.makedirs(output)
+        make_project(project, int(args.project_mb * 1e6))
+        history_file = args.history or os.path.join(root, "providers.sqlite")
+        with simulated(fleet, scale=args.scale, archive_size=args.project_mb * 1e6, frame_costs=make_costs(args.cost_profile, frames)) as simulation:
+            asyncio.run(addon_golem.main(
+                queue=Collector(),
+                budget=args.budget,
+                start_price=1,
+                cpu_price=1,
+                env_price=1,
+                timeout_global=args.timeout_global,
+                timeout_upload=args.timeout_upload,
+                timeout_render=args.timeout_render,
+                workers=args.workers,
+                format="PNG",
+                scene="scene",
+                frames=list(frames),
+                output_dir=output,
+                project_directory=project,
+                engine=args.engine,
+                pipeline_depth=args.pipeline_depth,
+                history_file=history_file,
+                selection=args.selection,
+                deadline=args.deadline,
+                estimate_every=estimate_every,
+                transfer=transfer,
+                check_frames=not args.no_check_frames))
+            golem = simulation.golems[0]
+            rendered = [name for name in os.listdir(output) if name.endswith(".png")]
+            bad = [name for name in rendered if check_frame(os.path.join(output, name))]
+            rendered = len(rendered)
+
+    makespan = golem.finished - golem.started
+    active = sum(provider.active_seconds * provider.gpus for provider in fleet)
+    busy = sum(provider.busy_seconds for provider in fleet)
+    downloaded = sum(provider.downloaded_bytes for provider in fleet)
+    download_seconds = sum(provider.download_seconds for provider in fleet)
+    print(f"frames rendered  {rendered}/{len(frames)}")
+    print(f"bad frames kept  {len(bad)}")
+    print(f"makespan         {makespan / 3600:.2f} h")
+    print(f"frames per hour  {rendered * 3600 / makespan:.1f}")
+    print(f"GLM spent        {golem.spent:.4f}")
+    print(f"GPU idle ratio   {1 - busy / active if active else 0:.1%}")
+    print(f"downloaded       {downloaded / 1e6:.0f} MB in {download_seconds / 60:.1f} min")
+    return makespan, downloaded, download_seconds
+
+def compare_estimate(args):
+    # Same fleet and shot with frames in order, then longest first from the cost pre-pass.
+    print("-- frames in order")
+    in_order = run(args, 0, args.transfer)[0]
+    print("-- cost pre-pass every " + str(args.estimate_every or 10) + " frames, longest first")
+    longest_first = run(args, args.estimate_every or 10, args.transfer)[0]
+    print(f"makespan saved   {(in_order - longest_first) / 60:.1f} min ({(in_order - longest_first) / in_order:.1%})")
+
+def compare_transfer(args):
+    # Same fleet and shot with per-frame raw downloads, then with the --transfer mode.
+    transfer = args.transfer if args.transfer != "FILES" else "COMPRESSED"
+    print("-- one download per frame")
+    files = run(args, args.estimate_every, "FILES")
+    print("-- " + transfer.lower() + " transfer")
+    bundled = run(args, args.estimate_every, transfer)
+    print(f"bytes saved      {(files[1] - bundled[1]) / 1e6:.0f} MB ({(files[1] - bundled[1]) / files[1]:.1%})")
+    print(f"download saved   {(files[2] - bundled[2]) / 60:.1f} min of provider time, makespan {(files[0] - bundled[0]) / 60:.1f} min")
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduling benchmark on a simulated provider fleet")
+    parser.add_argument("--frames", default="1-100")
+    parser.add_argument("--providers", type=int, default=6)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--gpus", type=int, default=1, help="GPUs per provider")
+    parser.add_argument("--frame-seconds", type=float, default=60, help="frame time on the fastest provider")
+    parser.add_argument("--speed-spread", type=float, default=2, help="slowest / fastest provider frame time")
+    parser.add_argument("--startup-seconds", type=float, default=20, help="blender start and scene load")
+    parser.add_argument("--upload-mbps", type=float, default=50)
+    parser.add_argument("--output-mb", type=float, default=5)
+    parser.add_argument("--download-latency", type=float, default=1, help="seconds to set up each download")
+    parser.add_argument("--compress-ratio", type=float, default=0.5, help="gzipped / raw size of the frames")
+    parser.add_argument("--transfer", default="FILES", choices=["FILES", "BUNDLE", "COMPRESSED"])
+    parser.add_argument("--compare-transfer", action="store_true", help="run with per-frame downloads and with --transfer and report what it saves")
+    parser.add_argument("--project-mb", type=float, default=50)
+    parser.add_argument("--price", type=float, default=1.0, help="GLM per hour of an average provider")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--hang-rate", type=float, default=0)
+    parser.add_argument("--corrupt-rate", type=float, default=0, help="frames rendered black without an error")
+    parser.add_argument("--no-check-frames", action="store_true", help="keep downloaded frames without checking them")
+    parser.add_argument("--engine", default="COMMAND", choices=["COMMAND", "SERVER"])
+    parser.add_argument("--pipeline-depth", type=int, default=1)
+    parser.add_argument("--selection", default="PRICE", choices=["PRICE", "THROUGHPUT", "DEADLINE"])
+    parser.add_argument("--deadline", type=float, default=4, help="hours")
+    parser.add_argument("--budget", type=float, default=100)
+    parser.add_argument("--timeout-global", type=int, default=24, help="hours")
+    parser.add_argument("--timeout-upload", type=int, default=30, help="minutes")
+    parser.add_argument("--timeout-render", type=int, default=30, help="minutes per frame")
+    parser.add_argument("--history", help="provider history database, a fresh one by default")
+    parser.add_argument("--scale", type=float, default=0.0005, help="real seconds per simulated second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cost-profile", default="flat", choices=["flat", "ramp", "spike"], help="relative frame costs along the shot")
+    parser.add_argument("--estimate-every", type=int, default=0, help="cost pre-pass probing every N frames, 0 for none")
+    parser.add_argument("--compare-estimate", action="store_true", help="run without and with the cost pre-pass and report the makespan saved")
+    args = parser.parse_args()
+    if args.compare_estimate:
+        compare_estimate(args)
+    elif args.compare_transfer:
+        compare_transfer(args)
+    else:
+        run(args, args.estimate_every, args.transfer)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,522 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import asyncio
+import tarfile
+import tempfile
+from io import BytesIO
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import yapapi
+from yapapi import events
+from yapapi.payload import vm
+from yapapi.executor.task import TaskStatus
+from yapapi.rest.activity import BatchTimeoutError
+
+import scheduler
+import telemetry
+import addon_golem
+import cost_estimate
+from output_transfer import BUNDLE_DIRECTORY
+
+# Offline stand-in for the parts of yapapi that addon_golem.main() uses: Golem, execute_tasks, work
+# context scripts (run, upload, download) and the events its consumer reads. Providers are simulated
+# in virtual time, `scale` real seconds per simulated second, and interpret the shell commands the
+# worker sends: chunk store, render commands, the queue runner and the render server.
+
+PRICE_PROPERTIES = {
+    "golem.com.pricing.model": "linear",
+    "golem.com.scheme": "payu",
+    "golem.com.usage.vector": ["golem.usage.cpu_sec", "golem.usage.duration_sec"],
+}
+
+# Simulated seconds between the end of a job's agreements and their invoices.
+INVOICE_DELAY = 5
+
+class Clock:
+    def __init__(self, scale):
+        self.scale = scale
+        self.origin = time.monotonic()
+
+    def monotonic(self):
+        return (time.monotonic() - self.origin) / self.scale
+
+    def time(self):
+        return time.time()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(max(0, seconds) * self.scale)
+
+class SimulatedProvider:
+    def __init__(self, name, frame_seconds=60, startup_seconds=20, upload_rate=5e6, download_rate=5e6,
+                 price_per_hour=1.0, failure_rate=0, hang_rate=0, output_size=5e6, gpu=None, gpus=1, seed=0,
+                 download_latency=1, compress_ratio=0.5, compress_rate=50e6, corrupt_rate=0):
+        self.name = name
+        self.provider_id = "0x" + hashlib.sha1(name.encode()).hexdigest()
+        self.frame_seconds = frame_seconds
+        self.startup_seconds = startup_seconds
+        self.upload_rate = upload_rate
+        self.download_rate = download_rate
+        self.price_per_hour = price_per_hour
+        self.failure_rate = failure_rate
+        # Frames rendered black without an error.
+        self.corrupt_rate = corrupt_rate
+        self.hang_rate = hang_rate
+        self.output_size = output_size
+        # Setup of each download, whatever its size, and how gzip does on the rendered frames.
+        self.download_latency = download_latency
+        self.compress_ratio = compress_ratio
+        self.compress_rate = compress_rate
+        self.gpu = gpu
+        self.gpus = gpus
+        # Relative cost of each frame of the scene, set by simulated().
+        self.frame_costs = {}
+        self.random = random.Random(seed)
+        # The chunk store survives activities, like a provider keeping its volume.
+        self.chunks = set()
+        self.busy_seconds = 0
+        self.active_seconds = 0
+        self.downloaded_bytes = 0
+        self.download_seconds = 0
+
+    def offer(self):
+        price = self.price_per_hour / 3600
+        props = dict(PRICE_PROPERTIES)
+        props["golem.com.pricing.model.linear.coeffs"] = [0.0, price, 0.0]
+        if self.gpu:
+            props["golem.inf.gpu.model"] = self.gpu
+        return SimpleNamespace(id="offer-" + self.name, issuer=self.provider_id, props=props)
+
+class Activity:
+    # One agreement with a provider: its /golem/output, queue and background renderers.
+    def __init__(self, provider, clock):
+        self.provider = provider
+        self.clock = clock
+        self.outputs = set()
+        self.corrupt = set()
+        self.requests = asyncio.Queue()
+        # Seconds each finished request rendered, timed by its lane like the queue runner does.
+        self.done = {}
+        self.changed = asyncio.Event()
+        self.background = []
+        self.server = False
+
+    def stop(self):
+        for task in self.background:
+            task.cancel()
+
+    async def render(self, items, startup):
+        # items: [(frame, output name)]. A failed chunk writes nothing, a hung one never returns.
+        provider = self.provider
+        started = self.clock.monotonic()
+        try:
+            if provider.random.random() < provider.hang_rate:
+                await asyncio.Event().wait()
+            failed = provider.random.random() < provider.failure_rate
+            await self.clock.sleep(startup)
+            for frame, name in items:
+                await self.clock.sleep(provider.frame_seconds * provider.frame_costs.get(frame, 1) * provider.random.uniform(0.9, 1.1))
+                if not failed:
+                    self.outputs.add(name)
+                    if provider.random.random() < provider.corrupt_rate:
+                        self.corrupt.add(name)
+                    else:
+                        self.corrupt.discard(name)
+        finally:
+            provider.busy_seconds += self.clock.monotonic() - started
+
+    async def run_queue(self):
+        while True:
+            request, content = await self.requests.get()
+            started = self.clock.monotonic()
+            if self.server:
+                renders = json.loads(content)['renders']
+                await self.render([(item['frame'], output_name(item['output'], item['format'], item['frame'])) for item in renders], 0)
+            else:
+                await self.render(command_items(content), self.provider.startup_seconds)
+            self.done[request] = self.clock.monotonic() - started
+            self.changed.set()
+
+    async def wait_request(self, request):
+        while request not in self.done:
+            self.changed.clear()
+            await self.changed.wait()
+        return self.done[request]
+
+FRAME_IMAGES = {}
+
+def frame_image(name, black=False):
+    # A small image in the output's format: the requestor checks the frames it downloads.
+    import numpy as np
+    import OpenImageIO as oiio
+    key = (os.path.splitext(name)[1], black)
+    if key not in FRAME_IMAGES:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "frame" + key[0])
+            output = oiio.ImageOutput.create(path)
+            output.open(path, oiio.ImageSpec(32, 18, 3, oiio.UINT8))
+            output.write_image(np.full((18, 32, 3), 0 if black else 128, dtype=np.uint8))
+            output.close()
+            with open(path, 'rb') as f:
+                FRAME_IMAGES[key] = f.read()
+    return FRAME_IMAGES[key]
+
+def output_name(pattern, format, frame):
+    ext = "exr" if format.startswith("OPEN_EXR") else format.lower()
+    name = pattern[len("/golem/output/"):]
+    if not name:
+        return f"{frame:04d}.{ext}"
+    return name.replace("####", f"{frame:04d}") + "." + ext
+
+def command_frames(command):
+    match = re.search(r"-s (\d+) -e (\d+) -j (\d+) -a", command)
+    if match:
+        start, end, step = (int(value) for value in match.groups())
+        return list(range(start, end + 1, step))
+    match = re.search(r"-f ([\d,]+)", command)
+    return [int(frame) for frame in match.group(1).split(",")]
+
+def command_items(command):
+    pattern = re.search(r"-o (\S+)", command).group(1)
+    format = re.search(r"-F (\S+)", command).group(1)
+    return [(frame, output_name(pattern, format, frame)) for frame in command_frames(command)]
+
+class SimulatedScript:
+    def __init__(self, ctx, timeout):
+        self.ctx = ctx
+        self.timeout = timeout.total_seconds() if timeout else None
+        self.commands = []
+
+    def run(self, *args):
+        future = asyncio.get_event_loop().create_future()
+        self.commands.append(('run', args[-1], future))
+        return future
+
+    def upload_file(self, source, destination):
+        self.commands.append(('upload', os.path.getsize(source), destination))
+
+    def upload_bytes(self, data, destination):
+        self.commands.append(('upload_bytes', data, destination))
+
+    def download_file(self, source, destination):
+        self.commands.append(('download', source, destination))
+
+class SimulatedContext:
+    def __init__(self, golem, provider):
+        self.golem = golem
+        self.provider = provider
+        self.provider_id = provider.provider_id
+        self.provider_name = provider.name
+        self.activity = Activity(provider, golem.clock)
+        self.files = {}
+        self.agreement = SimpleNamespace(id="agreement-" + provider.name, details=SimpleNamespace(
+            raw_details=SimpleNamespace(offer=SimpleNamespace(provider_id=provider.provider_id)),
+            provider_node_info=SimpleNamespace(name=provider.name),
+            provider_view=SimpleNamespace(properties=provider.offer().props)))
+        self._agreement_details = self.agreement.details
+
+    def new_script(self, timeout=None):
+        return SimulatedScript(self, timeout)
+
+    def emit(self, event_class, **kwargs):
+        event = event_class(job=self.golem.job, agreement=self.agreement, **kwargs)
+        self.golem.emit(event)
+        return event
+
+    def emit_task(self, event_class, task, **kwargs):
+        return self.emit(event_class, activity=self.activity, task=task, **kwargs)
+
+    async def execute(self, script):
+        try:
+            await asyncio.wait_for(self.execute_commands(script), script.timeout * self.golem.clock.scale if script.timeout else None)
+        except asyncio.TimeoutError:
+            raise BatchTimeoutError()
+
+    async def execute_commands(self, script):
+        clock = self.golem.clock
+        provider = self.provider
+        activity = self.activity
+        for kind, argument, extra in script.commands:
+            if kind == 'upload':
+                await clock.sleep(argument / provider.upload_rate)
+                if extra.startswith("/golem/resources/chunks/"):
+                    provider.chunks.add(extra.rsplit("/", 1)[1])
+            elif kind == 'upload_bytes':
+                await clock.sleep(len(argument) / provider.upload_rate)
+                self.files[extra] = argument.decode()
+            elif kind == 'download':
+                if argument in self.files:
+                    # A bundle of frames: one download, written as a real tar of placeholder frames.
+                    names = self.files.pop(argument)
+                    size = provider.output_size * len(names) * (provider.compress_ratio if argument.endswith(".gz") else 1)
+                    with tarfile.open(extra, 'w:gz' if argument.endswith(".gz") else 'w') as bundle:
+                        for name, black in names:
+                            image = frame_image(name, black)
+                            info = tarfile.TarInfo(name)
+                            info.size = len(image)
+                            bundle.addfile(info, BytesIO(image))
+                else:
+                    size = provider.output_size
+                    name = argument[len("/golem/output/"):]
+                    with open(extra, 'wb') as f:
+                        f.write(frame_image(name, name in activity.corrupt))
+                seconds = provider.download_latency + size / provider.download_rate
+                await clock.sleep(seconds)
+                provider.downloaded_bytes += size
+                provider.download_seconds += seconds
+            else:
+                extra.set_result(SimpleNamespace(stdout=await self.shell(argument)))
+
+    async def shell(self, command):
+        clock = self.golem.clock
+        activity = self.activity
+        if "ls /golem/resources/chunks" in command:
+            return " ".join(sorted(self.provider.chunks))
+        if "xargs cat" in command:
+            await clock.sleep(self.golem.archive_size / 200e6)
+            return ""
+        if "nvidia-xconfig" in command:
+            await clock.sleep(5)
+            return "gpus " + str(self.provider.gpus)
+        # One background renderer per lane, sharing the request queue.
+        if "nohup env DISPLAY=:1 blender" in command:
+            await clock.sleep(self.provider.startup_seconds)
+            activity.server = True
+            lanes = command.count("nohup")
+            activity.background.extend(asyncio.ensure_future(activity.run_queue()) for lane in range(lanes))
+            return " ".join("ready" + str(lane) for lane in range(lanes))
+        if "nohup sh" in command:
+            activity.background.extend(asyncio.ensure_future(activity.run_queue()) for lane in range(command.count("nohup")))
+            return ""
+        if command.startswith("mv ") and command.endswith(".request"):
+            source = command.split()[1]
+            request = source[:-len(".tmp")]
+            activity.requests.put_nowait((request, self.files.pop(source)))
+            return ""
+        if command.startswith("while [ ! -e "):
+            seconds = await activity.wait_request(command.split()[4][:-len(".done")])
+            return "rendered " + str(seconds) + "\n" + "\n".join(sorted(activity.outputs))
+        if command.startswith("mkdir -p " + BUNDLE_DIRECTORY):
+            words = command.split(" && ")[2].split()
+            bundle = next(word for word in words if word.startswith(BUNDLE_DIRECTORY))
+            names = words[words.index(bundle) + 1:]
+            activity.outputs.difference_update(names)
+            names = [(name, name in activity.corrupt) for name in names]
+            if bundle.endswith(".gz"):
+                await clock.sleep(self.provider.output_size * len(names) / self.provider.compress_rate)
+            self.files[bundle] = names
+            return ""
+        if "rm -rf /golem/output/*" in command:
+            activity.outputs.clear()
+            return ""
+        if command.startswith("cd /golem/output && rm -f "):
+            activity.outputs.difference_update(command.split()[5:])
+            return ""
+        if "blender -b" in command:
+            await activity.render(command_items(command), self.provider.startup_seconds)
+            return ""
+        if command.startswith("ls /golem/output"):
+            return "\n".join(sorted(activity.outputs))
+        return ""
+
+class SimulatedGolem:
+    def __init__(self, fleet, clock, archive_size=0, **kwargs):
+        self.fleet = fleet
+        self.clock = clock
+        self.archive_size = archive_size
+        self.budget = kwargs.get('budget')
+        self.strategy = kwargs.get('strategy')
+        self.consumers = []
+        self.spent = 0
+        self.started = None
+        self.finished = None
+
+    async def __aenter__(self):
+        self.started = self.clock.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.finished = self.clock.monotonic()
+
+    def add_event_consumer(self, consumer, event_classes_or_names=None):
+        # Like yapapi with ["JobEvent"], the only filter the worker uses.
+        self.consumers.append(consumer)
+
+    def emit(self, event):
+        for consumer in self.consumers:
+            consumer(event)
+
+    def execute_tasks(self, worker, data, payload=None, max_workers=1, timeout=None, job_id=None):
+        # Jobs of one engine may run at once, each with its own workers and task queue.
+        return SimulatedJob(self, job_id or "simulated").execute_tasks(worker, data, max_workers)
+
+class SimulatedJob:
+    def __init__(self, golem, job_id):
+        self.golem = golem
+        self.fleet = golem.fleet
+        self.clock = golem.clock
+        self.archive_size = golem.archive_size
+        self.job = SimpleNamespace(id=job_id)
+        self.subscription = SimpleNamespace(id="subscription-" + job_id)
+        self.invoices = []
+
+    def emit(self, event):
+        self.golem.emit(event)
+
+    async def score(self, provider):
+        if self.golem.strategy is None:
+            return 0
+        offer = provider.offer()
+        offer._subscription = self.subscription
+        return await self.golem.strategy.score_offer(offer)
+
+    async def execute_tasks(self, worker, data, max_workers):
+        self.emit(events.SubscriptionCreated(job=self.job, subscription=self.subscription))
+        self.buffer = asyncio.Queue(maxsize=1)
+        self.rescheduled = []
+        self.fed = False
+        self.working = {}
+        done_queue = asyncio.Queue()
+        feeder = asyncio.ensure_future(self.feed(data, done_queue))
+        hired = set()
+        try:
+            while True:
+                if len(self.working) < max_workers and (not self.fed or self.rescheduled or not self.buffer.empty()):
+                    candidates = [provider for provider in self.fleet if provider.name not in hired]
+                    scores = [(await self.score(provider), provider) for provider in candidates]
+                    scores = sorted((item for item in scores if item[0] >= 0), key=lambda item: item[0], reverse=True)
+                    for score, provider in scores[:max_workers - len(self.working)]:
+                        hired.add(provider.name)
+                        ctx = SimulatedContext(self, provider)
+                        self.working[asyncio.ensure_future(self.run_worker(ctx, worker))] = ctx
+                if not self.working:
+                    if self.fed and not self.rescheduled and self.buffer.empty():
+                        break
+                    raise RuntimeError("No provider left to render the remaining frames")
+                getter = asyncio.ensure_future(done_queue.get())
+                await asyncio.wait(set(self.working) | {getter}, timeout=10 * self.clock.scale, return_when=asyncio.FIRST_COMPLETED)
+                for future in [future for future in self.working if future.done()]:
+                    del self.working[future]
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+                while not done_queue.empty():
+                    yield done_queue.get_nowait()
+        finally:
+            feeder.cancel()
+            for future, ctx in self.working.items():
+                future.cancel()
+            await asyncio.gather(feeder, *self.working, return_exceptions=True)
+            # Like yagna, invoices come once the agreements have ended.
+            asyncio.ensure_future(self.send_invoices(self.invoices))
+            self.invoices = []
+
+    async def send_invoices(self, invoices):
+        await self.clock.sleep(INVOICE_DELAY)
+        for ctx, amount in invoices:
+            self.golem.spent += amount
+            ctx.emit(events.InvoiceAccepted, invoice=SimpleNamespace(amount=str(amount)))
+
+    async def feed(self, data, done_queue):
+        def on_task_done(task, status):
+            if status == TaskStatus.ACCEPTED:
+                done_queue.put_nowait(task)
+        async for task in data:
+            task._add_callback(on_task_done)
+            await self.buffer.put(task)
+        self.fed = True
+
+    async def next_task(self):
+        while True:
+            if self.rescheduled:
+                return self.rescheduled.pop(0)
+            if not self.buffer.empty():
+                return self.buffer.get_nowait()
+            if self.fed:
+                return None
+            await self.clock.sleep(0.1)
+
+    async def worker_tasks(self, ctx, running):
+        while True:
+            task = await self.next_task()
+            if task is None:
+                return
+            running.append(task)
+            task._start(lambda event_class, **kwargs: ctx.emit_task(event_class, **kwargs))
+            yield task
+
+    async def run_worker(self, ctx, worker):
+        running = []
+        started = self.clock.monotonic()
+        ctx.emit(events.AgreementConfirmed)
+        batches = worker(ctx, self.worker_tasks(ctx, running))
+        exc_info = None
+        try:
+            script = await batches.__anext__()
+            while True:
+                try:
+                    await ctx.execute(script)
+                except BatchTimeoutError as e:
+                    script = await batches.athrow(e)
+                    continue
+                # The running total of the agreement, as a debit note after each script.
+                due = ctx.provider.price_per_hour * (self.clock.monotonic() - started) / 3600
+                ctx.emit(events.DebitNoteAccepted, debit_note=SimpleNamespace(total_amount_due=str(due)))
+                script = await batches.asend(None)
+        except StopAsyncIteration:
+            pass
+        except Exception:
+            exc_info = sys.exc_info()
+        finally:
+            ctx.activity.stop()
+            # Unfinished tasks go back to the queue for another provider.
+            self.rescheduled.extend(task for task in running if task._status == TaskStatus.RUNNING)
+            seconds = self.clock.monotonic() - started
+            ctx.provider.active_seconds += seconds
+            amount = ctx.provider.price_per_hour * seconds / 3600
+            self.invoices.append((ctx, amount))
+            ctx.emit(events.WorkerFinished, activity=ctx.activity, exc_info=exc_info)
+
+@contextmanager
+def simulated(fleet, scale=0.001, archive_size=0, frame_costs=None, probe_seconds=20):
+    # Runs addon_golem.main() against the simulated fleet, in virtual time. The cost pre-pass takes
+    # probe_seconds and measures frame_costs with some noise.
+    clock = Clock(scale)
+    golems = []
+    for provider in fleet:
+        provider.frame_costs = frame_costs or {}
+    noise = random.Random(0)
+
+    def run_probes(blender_binary, blend_file, probes):
+        time.sleep(probe_seconds * scale)
+        return [(frame_costs or {}).get(frame, 1) * noise.uniform(0.8, 1.2) for frame in probes]
+
+    def make_golem(**kwargs):
+        golem = SimulatedGolem(fleet, clock, archive_size, **kwargs)
+        golems.append(golem)
+        return golem
+
+    async def repo(**kwargs):
+        return None
+
+    patches = [(yapapi, 'Golem', make_golem), (vm, 'repo', repo), (addon_golem, 'time', clock),
+               (scheduler, 'time', clock), (telemetry, 'time', clock), (scheduler, 'SPECULATE_INTERVAL', scheduler.SPECULATE_INTERVAL * scale),
+               (addon_golem, 'INVOICE_TIMEOUT', addon_golem.INVOICE_TIMEOUT * scale),
+               (cost_estimate, 'run_probes', run_probes)]
+    saved = [(module, name, getattr(module, name)) for module, name, value in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield SimpleNamespace(clock=clock, golems=golems)
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
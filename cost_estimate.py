@@ -0,0 +1,75 @@
+import re
+import time
+import bisect
+import tempfile
+import subprocess
+
+from frame_split import unit_frame, overrides_expression
+from scheduler import frames_argument
+
+# Optional pre-pass before a job: every Nth frame is rendered locally at a tiny resolution and sample
+# count, and the render times interpolated into a relative cost per frame (1 on average). The scheduler
+# then hands out the heaviest frames first, and sizes chunks and timeouts by cost.
+PROBE_RESOLUTION = 10
+PROBE_SAMPLES = 4
+# Blender prints " Time: 00:01.52 (Saving: 00:00.01)" once a frame is rendered.
+RENDER_TIME = re.compile(r"^\s*Time: ([\d:.]+) \(Saving")
+
+def probe_frames(frames, every):
+    frames = sorted(set(unit_frame(unit) for unit in frames))
+    probes = frames[::max(1, every)]
+    if probes[-1] != frames[-1]:
+        probes.append(frames[-1])
+    return probes
+
+def parse_seconds(text):
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def run_probes(blender_binary, blend_file, probes):
+    # Render time of each probe frame, None when blender failed.
+    overrides = {'render.resolution_percentage': PROBE_RESOLUTION, 'cycles.samples': PROBE_SAMPLES}
+    with tempfile.TemporaryDirectory() as output_directory:
+        cmd = [blender_binary, "-b", blend_file, "-o", output_directory + "/####", "-noaudio",
+               "--python-expr", overrides_expression(overrides)] + frames_argument(probes).split()
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        except OSError:
+            return None
+    times = [parse_seconds(match.group(1)) for match in map(RENDER_TIME.match, result.stdout.splitlines()) if match]
+    if len(times) != len(probes):
+        return None
+    return times
+
+def interpolate(probes, times, frames):
+    # Linear between probed frames, flat beyond them; normalized to 1 on average.
+    times = [max(seconds, 0.001) for seconds in times]
+    costs = {}
+    for frame in set(unit_frame(unit) for unit in frames):
+        index = bisect.bisect_left(probes, frame)
+        if index < len(probes) and probes[index] == frame:
+            costs[frame] = times[index]
+        elif index == 0:
+            costs[frame] = times[0]
+        elif index == len(probes):
+            costs[frame] = times[-1]
+        else:
+            ratio = (frame - probes[index - 1]) / (probes[index] - probes[index - 1])
+            costs[frame] = times[index - 1] + ratio * (times[index] - times[index - 1])
+    mean = sum(costs.values()) / len(costs)
+    return {frame: cost / mean for frame, cost in costs.items()}
+
+def estimate_costs(blender_binary, blend_file, frames, every):
+    # Relative cost of each frame, or None when the pre-pass failed: frames then go in order.
+    started = time.monotonic()
+    probes = probe_frames(frames, every)
+    times = run_probes(blender_binary, blend_file, probes)
+    if times is None:
+        print('Cost pre-pass failed, frames are rendered in order')
+        return None
+    costs = interpolate(probes, times, frames)
+    heaviest = max(costs, key=costs.get)
+    print('Cost pre-pass: ' + str(len(probes)) + ' frames probed in ' + str(round(time.monotonic() - started)) + 's, heaviest frame ' + str(heaviest) + ' at ' + str(round(costs[heaviest], 2)) + 'x the average')
+    return costs
@@ -0,0 +1,93 @@
+import os
+import re
+import glob
+import bpy
+
+UDIM_TOKENS = ("<UDIM>", "<UVTILE>")
+
+def _sequence_files(path):
+    directory, name = os.path.split(path)
+    match = re.match(r"^(.*?)(\d+)(\D*)$", name)
+    if match is None or not os.path.isdir(directory):
+        return [path]
+    pattern = re.compile(re.escape(match.group(1)) + r"\d+" + re.escape(match.group(3)) + "$")
+    return [os.path.join(directory, file) for file in os.listdir(directory) if pattern.match(file)]
+
+def _udim_files(path):
+    pattern = path
+    for token in UDIM_TOKENS:
+        pattern = pattern.replace(token, "*")
+    return glob.glob(pattern)
+
+def _expand(path):
+    if any(token in path for token in UDIM_TOKENS):
+        return _udim_files(path)
+    if os.path.isdir(path):
+        files = []
+        for subdir, dirs, filenames in os.walk(path):
+            files.extend(os.path.join(subdir, file) for file in filenames)
+        return files
+    return [path]
+
+def _abspath(path, library=None):
+    return os.path.normpath(bpy.path.abspath(path, library=library))
+
+def _sequence_paths():
+    for image in bpy.data.images:
+        if image.source == 'SEQUENCE' and image.packed_file is None:
+            yield _abspath(image.filepath, image.library)
+    for clip in bpy.data.movieclips:
+        if clip.source == 'SEQUENCE':
+            yield _abspath(clip.filepath, clip.library)
+    for volume in bpy.data.volumes:
+        if volume.is_sequence and volume.packed_file is None:
+            yield _abspath(volume.filepath, volume.library)
+    for cache_file in bpy.data.cache_files:
+        if cache_file.is_sequence:
+            yield _abspath(cache_file.filepath, cache_file.library)
+
+def _is_inside(directory, path):
+    try:
+        return os.path.commonpath([directory, path]) == directory
+    except ValueError:
+        return False
+
+def collect_dependencies(project_directory):
+    project_directory = os.path.normpath(project_directory)
+    paths = set(_expand(os.path.normpath(bpy.data.filepath)))
+
+    for path in bpy.utils.blend_paths(absolute=True, packed=False, local=False):
+        paths.update(_expand(os.path.normpath(path)))
+    for path in _sequence_paths():
+        paths.update(_sequence_files(path))
+
+    # Disk point caches (particles, cloth, ...) default to //blendcache_<name> and are not listed as paths.
+    blend_name = bpy.path.display_name_from_filepath(bpy.data.filepath)
+    blendcache_directory = os.path.join(project_directory, "blendcache_" + blend_name)
+    if os.path.isdir(blendcache_directory):
+        paths.update(_expand(blendcache_directory))
+
+    files = []
+    missing = []
+    outside = []
+    for path in sorted(paths):
+        if not os.path.isfile(path):
+            missing.append(path)
+        elif not _is_inside(project_directory, path):
+            outside.append(path)
+        else:
+            files.append((path, os.path.relpath(path, start=project_directory).replace(os.sep, "/")))
+    return files, missing, outside
+
+def directory_size(project_directory):
+    size = 0
+    for subdir, dirs, filenames in os.walk(project_directory):
+        for file in filenames:
+            try:
+                size += os.path.getsize(os.path.join(subdir, file))
+            except OSError:
+                pass
+    return size
+
+def files_size(files):
+    return sum(os.path.getsize(srcpath) for srcpath, name in files)
@@ -0,0 +1,67 @@
+import os
+
+# Checks of each downloaded render unit before it is accepted. Blender on a provider can exit without
+# an error and leave an empty, truncated, black or NaN-filled image, which would otherwise be kept and
+# the provider trusted with the next chunks.
+MIN_BYTES = 64
+# Scanlines read for the pixel statistics, spread over the image. The last one catches truncation.
+SAMPLE_ROWS = 16
+BLACK_LEVEL = 1e-4
+# A unit rejected this many times for being black is accepted anyway: some frames are meant to be
+# black. Other failures are rejected every time.
+MAX_REJECTIONS = 2
+
+def check_frame(path, size=None, tolerance=0, black=True):
+    # Why the image at path is wrong, None when it looks right. size: expected (width, height).
+    # black: whether an all black image is wrong; not for tiles and sample passes, which can be.
+    try:
+        if os.path.getsize(path) < MIN_BYTES:
+            return "empty"
+    except OSError:
+        return "missing"
+    try:
+        import numpy as np
+        import OpenImageIO as oiio
+    except ImportError:
+        return None
+    image = oiio.ImageInput.open(path)
+    if image is None:
+        return "unreadable"
+    try:
+        spec = image.spec()
+        if size and (abs(spec.width - size[0]) > tolerance or abs(spec.height - size[1]) > tolerance):
+            return "resolution " + str(spec.width) + "x" + str(spec.height)
+        rows = sorted(set(spec.y + (spec.height - 1) * index // (SAMPLE_ROWS - 1) for index in range(SAMPLE_ROWS)))
+        color = min(spec.nchannels, 3)
+        peak = 0.0
+        for y in rows:
+            pixels = image.read_scanline(y, 0, oiio.FLOAT)
+            if pixels is None:
+                return "truncated"
+            pixels = pixels.reshape(spec.width, spec.nchannels)[:, :color]
+            if not np.isfinite(pixels).all():
+                return "nan"
+            peak = max(peak, float(pixels.max()))
+        # Some readers (JPEG) return what they could decode of a short file, with an error.
+        if image.geterror():
+            return "truncated"
+        if black and peak <= BLACK_LEVEL:
+            return "black"
+    finally:
+        image.close()
+    return None
+
+class FrameChecks:
+    def __init__(self):
+        self.rejections = {}
+
+    def check(self, unit, path, size=None, tolerance=0):
+        # Tile and sample units are tuples: a dark part of a frame is not a black frame.
+        reason = check_frame(path, size, tolerance, black=not isinstance(unit, tuple))
+        if reason != "black":
+            return reason
+        self.rejections[unit] = self.rejections.get(unit, 0) + 1
+        if self.rejections[unit] > MAX_REJECTIONS:
+            print('Accepting ' + str(unit) + ' (' + reason + ') after ' + str(MAX_REJECTIONS) + ' rejections')
+            return None
+        return reason
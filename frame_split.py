@@ -0,0 +1,194 @@
+import os
+import math
+import subprocess
+
+# A frame can be split into several render units, each rendered by a different provider:
+# a unit is either a whole frame (int) or a (frame, kind, index) tuple.
+
+def unit_frame(unit):
+    return unit if isinstance(unit, int) else unit[0]
+
+def unit_suffix(unit):
+    if isinstance(unit, int):
+        return ""
+    return "_" + unit[1] + f"{unit[2]:02d}"
+
+def overrides_expression(overrides):
+    lines = ["import bpy", "scene = bpy.context.scene"]
+    for path, value in overrides.items():
+        lines.append("scene." + path + " = " + repr(value))
+    return "; ".join(lines)
+
+def tile_grid(count, width, height):
+    # Pick the columns x rows grid whose tiles are closest to square.
+    best = None
+    for columns in range(1, count + 1):
+        if count % columns:
+            continue
+        rows = count // columns
+        ratio = (width / columns) / (height / rows)
+        score = abs(math.log(ratio))
+        if best is None or score < best[0]:
+            best = (score, columns, rows)
+    return best[1], best[2]
+
+def tile_regions(count, width, height):
+    columns, rows = tile_grid(count, width, height)
+    regions = []
+    for row in range(rows):
+        for column in range(columns):
+            xmin = width * column // columns
+            xmax = width * (column + 1) // columns
+            ymin = height * row // rows
+            ymax = height * (row + 1) // rows
+            regions.append((xmin, xmax, ymin, ymax))
+    return regions
+
+def tile_overrides(region, width, height):
+    xmin, xmax, ymin, ymax = region
+    # Blender truncates border * resolution to pixels: aim half a pixel in to land on exact edges.
+    return {
+        "render.use_border": True,
+        "render.use_crop_to_border": True,
+        "render.border_min_x": min(1.0, (xmin + 0.5) / width),
+        "render.border_max_x": min(1.0, (xmax + 0.5) / width),
+        "render.border_min_y": min(1.0, (ymin + 0.5) / height),
+        "render.border_max_y": min(1.0, (ymax + 0.5) / height),
+    }
+
+def sample_overrides(index, count, samples):
+    # Each part renders its own noise pattern with 1/count of the samples, averaged back locally.
+    return {
+        "cycles.seed": index,
+        "cycles.use_animated_seed": False,
+        "cycles.samples": max(1, math.ceil(samples / count)),
+        "render.image_settings.color_depth": '32',
+    }
+
+def _open_image(path):
+    import OpenImageIO as oiio
+    # Keep PNG/JPEG pixels as written: no alpha association round trip.
+    config = oiio.ImageSpec()
+    config.attribute("oiio:UnassociatedAlpha", 1)
+    image = oiio.ImageInput.open(path, config)
+    if image is None:
+        raise IOError("Cannot open " + path + ": " + oiio.geterror())
+    return image
+
+def _subimage_count(image):
+    count = 1
+    while image.seek_subimage(count, 0):
+        count += 1
+    image.seek_subimage(0, 0)
+    return count
+
+def _full_spec(tile_spec, width, height):
+    import OpenImageIO as oiio
+    spec = oiio.ImageSpec(tile_spec)
+    spec.width = spec.full_width = width
+    spec.height = spec.full_height = height
+    spec.x = spec.y = spec.full_x = spec.full_y = 0
+    spec.attribute("oiio:UnassociatedAlpha", 1)
+    return spec
+
+def _numpy_type(spec):
+    import numpy as np
+    import OpenImageIO as oiio
+    return {
+        oiio.UINT8: np.uint8,
+        oiio.UINT16: np.uint16,
+        oiio.HALF: np.float16,
+        oiio.FLOAT: np.float32,
+    }.get(spec.format.basetype, np.float32)
+
+def read_specs(path):
+    import OpenImageIO as oiio
+    image = _open_image(path)
+    specs = []
+    for subimage in range(_subimage_count(image)):
+        image.seek_subimage(subimage, 0)
+        specs.append(oiio.ImageSpec(image.spec()))
+    image.close()
+    return specs
+
+def open_output(output_path, specs):
+    import OpenImageIO as oiio
+    output = oiio.ImageOutput.create(output_path)
+    if output is None:
+        raise IOError("Cannot write " + output_path + ": " + oiio.geterror())
+    if len(specs) > 1:
+        output.open(output_path, specs)
+    else:
+        output.open(output_path, specs[0])
+    return output
+
+def stitch_tiles(tiles, width, height, output_path):
+    import numpy as np
+
+    # Every subimage (EXR parts) and every channel (multilayer passes) is stitched.
+    specs = [_full_spec(spec, width, height) for spec in read_specs(tiles[0][0])]
+    output = open_output(output_path, specs)
+    for subimage, spec in enumerate(specs):
+        if subimage:
+            output.open(output_path, spec, "AppendSubimage")
+        canvas = np.zeros((height, width, spec.nchannels), dtype=_numpy_type(spec))
+        for path, (xmin, xmax, ymin, ymax) in tiles:
+            image = _open_image(path)
+            image.seek_subimage(subimage, 0)
+            pixels = image.read_image(spec.format)
+            image.close()
+            top = height - ymax
+            rows = min(pixels.shape[0], height - top)
+            columns = min(pixels.shape[1], width - xmin)
+            canvas[top:top + rows, xmin:xmin + columns] = pixels[:rows, :columns]
+        if not output.write_image(canvas):
+            raise IOError("Cannot write " + output_path + ": " + output.geterror())
+    output.close()
+
+def merge_samples(paths, output_path, rows=32):
+    import numpy as np
+
+    # Scanline blocks of every part are averaged and written straight away: memory stays bounded
+    # by rows x width x channels x parts, whatever the resolution.
+    images = [_open_image(path) for path in paths]
+    specs = read_specs(paths[0])
+    output = open_output(output_path, specs)
+    try:
+        for subimage, spec in enumerate(specs):
+            if subimage:
+                output.open(output_path, spec, "AppendSubimage")
+            for image in images:
+                image.seek_subimage(subimage, 0)
+            for ybegin in range(spec.y, spec.y + spec.height, rows):
+                yend = min(ybegin + rows, spec.y + spec.height)
+                block = np.zeros((yend - ybegin, spec.width, spec.nchannels), dtype=np.float64)
+                for image in images:
+                    block += image.read_scanlines(subimage, 0, ybegin, yend, 0, 0, spec.nchannels).reshape(block.shape)
+                block /= len(images)
+                if not output.write_scanlines(ybegin, yend, 0, block.astype(np.float32)):
+                    raise IOError("Cannot write " + output_path + ": " + output.geterror())
+    finally:
+        output.close()
+        for image in images:
+            image.close()
+
+def save_as_render(blender_binary, blend_file, image_path, output_path, format):
+    # Display formats need the scene's view transform and look, only Blender applies them exactly.
+    expression = "; ".join([
+        "import bpy",
+        "scene = bpy.context.scene",
+        "scene.render.image_settings.file_format = " + repr(format),
+        "image = bpy.data.images.load(" + repr(image_path) + ")",
+        "image.save_render(" + repr(output_path) + ", scene=scene)",
+    ])
+    subprocess.run([blender_binary, "-b", blend_file, "-noaudio", "--python-expr", expression],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    if not os.path.exists(output_path):
+        raise IOError("Blender did not write " + output_path)
+
+def remove_parts(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
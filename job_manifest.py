@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import hashlib
+
+# Every render writes its job manifest in its output folder, and records frames as they complete:
+# a cancelled, failed or crashed job can be resumed with only its missing frames.
+JOB_FILE = "job.json"
+
+def output_extension(format):
+    if format in ["OPEN_EXR_MULTILAYER", "OPEN_EXR"]:
+        return "exr"
+    return format.lower()
+
+def frame_file(output_directory, frame, format):
+    return os.path.join(output_directory, f"{frame:04d}." + output_extension(format))
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def write_job(output_directory, job):
+    path = os.path.join(output_directory, JOB_FILE)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(job, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def load_job(output_directory):
+    try:
+        with open(os.path.join(output_directory, JOB_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def create_job(output_directory, scene, scene_hash, frames, settings):
+    job = {
+        'scene': scene,
+        'scene_hash': scene_hash,
+        'created': time.time(),
+        'frames': list(frames),
+        'settings': settings,
+        'completed': [],
+    }
+    write_job(output_directory, job)
+    return job
+
+def mark_completed(output_directory, frames):
+    job = load_job(output_directory)
+    if job is None:
+        return
+    job['completed'] = sorted(set(job['completed']).union(frames))
+    job['updated'] = time.time()
+    write_job(output_directory, job)
+
+def missing_frames(output_directory, job):
+    # A frame recorded as completed whose file went missing or is empty is rendered again.
+    missing = []
+    completed = set(job['completed'])
+    for frame in job['frames']:
+        path = frame_file(output_directory, frame, job['settings']['format'])
+        if frame not in completed or not os.path.exists(path) or os.path.getsize(path) == 0:
+            missing.append(frame)
+    return missing
+
+def latest_unfinished_job(main_output_directory, scene):
+    # The most recent job of this scene still missing frames, as (output_directory, job, missing frames).
+    try:
+        names = os.listdir(main_output_directory)
+    except OSError:
+        return None
+    directories = [os.path.join(main_output_directory, name) for name in names]
+    directories = [directory for directory in directories if os.path.isfile(os.path.join(directory, JOB_FILE))]
+    jobs = [(directory, load_job(directory)) for directory in directories]
+    jobs = [(directory, job) for directory, job in jobs if job is not None and job['scene'] == scene]
+    for directory, job in sorted(jobs, key=lambda item: item[1]['created'], reverse=True):
+        missing = missing_frames(directory, job)
+        if missing:
+            return directory, job, missing
+    return None
@@ -0,0 +1,189 @@
+import os
+import json
+
+from job_manifest import file_hash, create_job, load_job, missing_frames
+
+# Job specs are JSON files describing a render without Blender's UI:
+#   {"blend": "sh010/sh010.blend", "frames": "1-250", "output": "renders/sh010", "priority": 1, "budget": 5}
+# Paths are relative to the spec file. Prices are in mGLM per hour like in the panel, timeouts in hours
+# (global) and minutes (upload, render per frame), memory (GB) and threads per GPU. Rendering again into
+# the output folder of an unfinished job resumes it, with the same frames.
+SPEC_DEFAULTS = {
+    'priority': 0,
+    'network': "goerli",
+    'budget': 10,
+    'format': "PNG",
+    'start_price': 0,
+    'cpu_price': 0,
+    'env_price': 0,
+    'timeout_global': 4,
+    'timeout_upload': 10,
+    'timeout_render': 10,
+    'timeout_percentile': 95,
+    'timeout_margin': 2.0,
+    'workers': 1,
+    'memory': 8,
+    'storage': 8,
+    'threads': 8,
+    'engine': "COMMAND",
+    'pipeline_depth': 1,
+    'split_mode': "NONE",
+    'split_parts': 4,
+    'resolution': None,
+    'samples': 0,
+    'selection': "PRICE",
+    'deadline': 4,
+    'estimate_every': 0,
+    'transfer': "FILES",
+    'exr_codec': None,
+    'png_compression': None,
+    'check_frames': True,
+    'contact_sheet': False,
+    'preview_movie': False,
+    'preview_fps': 24,
+    'blender_binary': "blender",
+    'files': None,
+}
+
+class SpecError(Exception):
+    pass
+
+def parse_frames(frames):
+    # "1-100,120,130-140:2", or a list of frames.
+    if isinstance(frames, list):
+        return [int(frame) for frame in frames]
+    result = []
+    for part in str(frames).split(","):
+        step = 1
+        if ":" in part:
+            part, step = part.split(":")
+            step = int(step)
+        if "-" in part:
+            start, end = part.split("-")
+            result.extend(range(int(start), int(end) + 1, step))
+        else:
+            result.append(int(part))
+    return result
+
+def load_spec(path):
+    try:
+        with open(path) as f:
+            spec = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SpecError(path + ": " + str(e))
+    unknown = set(spec) - set(SPEC_DEFAULTS) - {'blend', 'frames', 'output'}
+    if unknown:
+        raise SpecError(path + ": unknown keys " + ", ".join(sorted(unknown)))
+    for key in ['blend', 'frames', 'output']:
+        if key not in spec:
+            raise SpecError(path + ": missing " + key)
+    spec = dict(SPEC_DEFAULTS, **spec)
+    base_directory = os.path.dirname(os.path.abspath(path))
+    spec['blend'] = os.path.normpath(os.path.join(base_directory, spec['blend']))
+    spec['output'] = os.path.normpath(os.path.join(base_directory, spec['output']))
+    if spec['files'] is not None:
+        spec['files'] = [os.path.normpath(os.path.join(base_directory, file)) for file in spec['files']]
+    if spec['split_mode'] != "NONE" and spec['resolution'] is None:
+        raise SpecError(path + ": split frames need the resolution")
+    if spec['split_mode'] == "SAMPLES" and spec['samples'] <= 0:
+        # Each part renders samples / split_parts: without them every part gets a single sample.
+        raise SpecError(path + ": frames split by samples need the scene's samples")
+    return spec
+
+def spec_paths(paths):
+    # Spec files, and the spec files of directories, in name order.
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json"))
+        else:
+            found.append(path)
+    return found
+
+def job_name(path, names):
+    name = os.path.splitext(os.path.basename(path))[0]
+    candidate = name
+    index = 1
+    while candidate in names:
+        index += 1
+        candidate = name + "-" + str(index)
+    return candidate
+
+def check_spec(spec):
+    # What would stop daemon_job, without writing anything: specs of a batch are all checked first.
+    if not os.path.isfile(spec['blend']):
+        raise SpecError(spec['blend'] + ": no such blend file")
+    try:
+        frames = parse_frames(spec['frames'])
+    except ValueError:
+        raise SpecError(spec['output'] + ": bad frames " + str(spec['frames']))
+    scene = os.path.splitext(os.path.basename(spec['blend']))[0]
+    job = load_job(spec['output'])
+    if job is not None and job['scene'] == scene and sorted(job['frames']) != sorted(frames):
+        raise SpecError(spec['output'] + ": holds a job of other frames, render them into another folder")
+
+def daemon_job(spec):
+    # The render daemon's spec of a job: creates its manifest in the output folder, or resumes the
+    # unfinished job already there. None when every frame is already rendered.
+    check_spec(spec)
+    scene = os.path.splitext(os.path.basename(spec['blend']))[0]
+    output_directory = spec['output']
+    os.makedirs(output_directory, exist_ok=True)
+    job = load_job(output_directory)
+    if job is not None and job['scene'] == scene:
+        frames = missing_frames(output_directory, job)
+        settings = job['settings']
+    else:
+        settings = {
+            'format': spec['format'],
+            'split_mode': spec['split_mode'],
+            'split_parts': spec['split_parts'],
+            'resolution': spec['resolution'],
+            'samples': spec['samples'],
+        }
+        job = create_job(output_directory, scene, file_hash(spec['blend']), parse_frames(spec['frames']), settings)
+        frames = list(job['frames'])
+    if not frames:
+        return None
+    return {
+        'priority': spec['priority'],
+        'network': spec['network'],
+        'budget': spec['budget'],
+        'job': {
+            'start_price': spec['start_price']/3600000,
+            'cpu_price': spec['cpu_price']/3600000,
+            'env_price': spec['env_price']/3600000,
+            'timeout_global': spec['timeout_global'],
+            'timeout_upload': spec['timeout_upload'],
+            'timeout_render': spec['timeout_render'],
+            'workers': spec['workers'],
+            'memory': spec['memory'],
+            'storage': spec['storage'],
+            'threads': spec['threads'],
+            'format': settings['format'],
+            'scene': scene,
+            'frames': frames,
+            'output_dir': output_directory,
+            'project_directory': os.path.dirname(spec['blend']),
+            'project_files': spec['files'],
+            'engine': spec['engine'],
+            'pipeline_depth': spec['pipeline_depth'],
+            'split_mode': settings['split_mode'],
+            'split_parts': settings['split_parts'],
+            'resolution': tuple(settings['resolution']) if settings['resolution'] else None,
+            'samples': settings['samples'],
+            'blender_binary': spec['blender_binary'],
+            'selection': spec['selection'],
+            'deadline': spec['deadline'],
+            'timeout_percentile': spec['timeout_percentile'],
+            'timeout_margin': spec['timeout_margin'],
+            'estimate_every': spec['estimate_every'],
+            'transfer': spec['transfer'],
+            'exr_codec': spec['exr_codec'],
+            'png_compression': spec['png_compression'],
+            'check_frames': spec['check_frames'],
+            'contact_sheet': spec['contact_sheet'],
+            'preview_movie': spec['preview_movie'],
+            'preview_fps': spec['preview_fps'],
+        },
+    }
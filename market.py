@@ -0,0 +1,139 @@
+import time
+
+from yapapi.strategy import WrappingMarketStrategy, SCORE_NEUTRAL, SCORE_REJECTED
+from yapapi.props import com
+
+# Frame time assumed for a scene never rendered before: offers still rank right, only the forecast is rough.
+DEFAULT_FRAME_SECONDS = 60
+# CPU seconds billed per second of GPU rendering. Providers meter golem.usage.cpu_sec as the CPU time of
+# the whole VM: Cycles keeps one host thread busy per GPU (it waits on the device by spinning), and the
+# other threads offered stay idle.
+RENDER_CPU_LOAD = 1.0
+
+def offer_gpu(props):
+    for key, value in props.items():
+        if ".gpu." in key and key.rsplit(".", 1)[-1] in ["model", "name", "card"]:
+            return str(value)
+    return None
+
+class HistoryMarketStrategy(WrappingMarketStrategy):
+    # Scales the wrapped strategy's score by the provider's past speed and reliability, and rejects
+    # known stragglers before an agreement is signed.
+    def __init__(self, base_strategy, history):
+        super().__init__(base_strategy)
+        self.history = history
+
+    async def score_offer(self, offer):
+        score = await self.base_strategy.score_offer(offer)
+        if score < SCORE_NEUTRAL:
+            return score
+        weight = self.history.weight(offer.issuer)
+        if weight is None:
+            return SCORE_REJECTED
+        return score * weight
+
+class ThroughputMarketStrategy(WrappingMarketStrategy):
+    # Ranks offers by frames per GLM, or by speed when the job has a deadline: then offers are rejected
+    # while the job, rendered by the best offers, would miss the deadline or overrun the budget.
+    # The wrapped strategy still enforces the price caps. remaining: frames left to render.
+    def __init__(self, base_strategy, history, scene, frames, workers, budget, deadline=None, frame_time=None, on_estimate=None, remaining=None):
+        super().__init__(base_strategy)
+        self.history = history
+        self.scene = scene
+        self.frames = frames
+        self.workers = max(1, workers)
+        self.budget = budget
+        self.deadline = deadline
+        self.frame_time = frame_time
+        self.on_estimate = on_estimate
+        self.remaining = remaining or (lambda: frames)
+        self.started = time.monotonic()
+        self.offers = {}
+
+    def reference_frame_time(self):
+        measured = self.frame_time() if self.frame_time else None
+        return measured or self.history.scene_frame_time(self.scene) or DEFAULT_FRAME_SECONDS
+
+    def estimate(self, offer):
+        # (seconds per frame, GLM per frame) on this provider.
+        provider_id = offer.issuer
+        gpu = offer_gpu(offer.props)
+        if gpu:
+            self.history.record_hardware(provider_id, gpu)
+        frame_time = self.history.frame_time(provider_id, self.scene)
+        if frame_time is None:
+            relative_time = self.history.relative_time(provider_id) or (gpu and self.history.gpu_relative_time(gpu)) or 1.0
+            frame_time = relative_time * self.reference_frame_time()
+        linear = com.ComLinear.from_properties(offer.props)
+        price_per_second = sum(price * (RENDER_CPU_LOAD if counter == com.Counter.CPU.value else 1)
+                               for counter, price in linear.price_for.items())
+        frames_per_provider = max(1, self.remaining() / self.workers)
+        return frame_time, price_per_second * frame_time + linear.fixed_price / frames_per_provider
+
+    def forecast(self, offers):
+        # Cost and duration of the remaining frames if the best of offers render them together, the
+        # workers not hired yet rendering like the average of those.
+        best = sorted(offers, key=lambda offer: offer[2], reverse=True)[:self.workers]
+        if not best:
+            return None
+        frames = self.remaining()
+        throughput = sum(1 / frame_time for frame_time, frame_cost, score in best)
+        cost = sum(frames * (1 / frame_time) / throughput * frame_cost for frame_time, frame_cost, score in best)
+        return cost, frames / (throughput * self.workers / len(best))
+
+    async def score_offer(self, offer):
+        score = await self.base_strategy.score_offer(offer)
+        if score < SCORE_NEUTRAL:
+            return score
+        reliability = self.history.reliability(offer.issuer)
+        if reliability is None:
+            return SCORE_REJECTED
+        frame_time, frame_cost = self.estimate(offer)
+        if self.deadline:
+            score = reliability / frame_time
+            # Checked for the job, not for the offer alone. The share of the budget left goes with the share
+            # of the frames left.
+            cost, seconds = self.forecast(list(self.offers.values()) + [(frame_time, frame_cost, score)])
+            if seconds > self.deadline - (time.monotonic() - self.started) or cost > self.budget * self.remaining() / max(self.frames, 1):
+                return SCORE_REJECTED
+        else:
+            score = reliability / max(frame_cost, 1e-12)
+        self.offers[offer.issuer] = (frame_time, frame_cost, score)
+        if self.on_estimate:
+            self.on_estimate(*self.forecast(self.offers.values()))
+        return score
+
+class SessionMarketStrategy(WrappingMarketStrategy):
+    # Strategy of a Golem engine that outlives its jobs, and may run several at once. yapapi does not
+    # replace the strategy of a running engine: offers are scored by the strategy of the job whose demand
+    # they answer instead, found from their subscription.
+    def __init__(self, base_strategy):
+        super().__init__(base_strategy)
+        self.jobs = {}
+        self.subscriptions = {}
+
+    def use(self, job_id, strategy):
+        self.jobs[job_id] = strategy
+
+    def subscribed(self, job_id, subscription_id):
+        self.subscriptions[subscription_id] = job_id
+
+    def release(self, job_id):
+        self.jobs.pop(job_id, None)
+        self.subscriptions = {subscription_id: job for subscription_id, job in self.subscriptions.items() if job != job_id}
+
+    def job_strategy(self, offer):
+        subscription = getattr(offer, '_subscription', None)
+        job_id = self.subscriptions.get(subscription.id) if subscription is not None else None
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        # The subscription of a job that just started may not be known yet: it is the newest job's.
+        if self.jobs:
+            return list(self.jobs.values())[-1]
+        return self.base_strategy
+
+    async def score_offer(self, offer):
+        return await self.job_strategy(offer).score_offer(offer)
+
+    async def respond_to_provider_offer(self, our_demand, provider_offer):
+        return await self.job_strategy(provider_offer).respond_to_provider_offer(our_demand, provider_offer)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tarfile
+
+# How rendered frames come back from the provider:
+#   FILES: one download per frame, as rendered.
+#   BUNDLE: the frames of a chunk in one tar, one download, extracted into the output folder.
+#   COMPRESSED: the same tar gzipped on the provider, for BMP or uncompressed EXR frames.
+# Whole frames can also be encoded smaller by Blender on the provider (EXR codec, PNG compression).
+# Parts of split frames are not: they are encoded again once assembled.
+BUNDLE_DIRECTORY = "/golem/resources/.bundles"
+# Fast gzip: most of the gain on raw frames, little provider time.
+GZIP_COMMAND = "gzip -1"
+
+def encoding_overrides(format, exr_codec=None, png_compression=None):
+    overrides = {}
+    if exr_codec and format in ["OPEN_EXR", "OPEN_EXR_MULTILAYER"]:
+        overrides['render.image_settings.exr_codec'] = exr_codec
+    if png_compression is not None and format == "PNG":
+        overrides['render.image_settings.compression'] = png_compression
+    return overrides
+
+def bundle_name(task_id, transfer):
+    return "chunk" + str(task_id) + (".tar.gz" if transfer == "COMPRESSED" else ".tar")
+
+def bundle_command(names, bundle, transfer):
+    # The outputs move into the bundle, so that the next chunks of the provider do not list them.
+    tar = "tar --use-compress-program='" + GZIP_COMMAND + "' -cf " if transfer == "COMPRESSED" else "tar -cf "
+    return "mkdir -p " + BUNDLE_DIRECTORY + " && cd /golem/output && " + tar + BUNDLE_DIRECTORY + "/" + bundle + " " + " ".join(names) + " && rm -f " + " ".join(names)
+
+def extract_bundle(bundle_file, destinations):
+    # destinations: local path of each output name. Members are read in one pass, without
+    # extracting the whole bundle first. Returns the bytes extracted.
+    size = 0
+    try:
+        with tarfile.open(bundle_file, 'r|*') as bundle:
+            for member in bundle:
+                if not member.isfile() or member.name not in destinations:
+                    continue
+                with open(destinations[member.name], 'wb') as f:
+                    shutil.copyfileobj(bundle.extractfile(member), f, 1048576)
+                size += member.size
+    finally:
+        os.remove(bundle_file)
+    return size
+
+class TransferStats:
+    # Bytes downloaded against the bytes of the frames, for the transfer report.
+    def __init__(self):
+        self.bytes = 0
+        self.raw_bytes = 0
+        self.seconds = 0
+        self.downloads = 0
+        self.files = 0
+
+    def record(self, size, raw_size, seconds, files):
+        self.bytes += size
+        self.raw_bytes += raw_size
+        self.seconds += seconds
+        self.downloads += 1
+        self.files += files
+
+    def saved_seconds(self):
+        if not self.bytes or not self.seconds:
+            return 0
+        # Raw frames at the rate observed. A lower bound: the round trip of each frame's download is
+        # saved too.
+        return max(0, self.seconds * (self.raw_bytes / self.bytes - 1))
+
+    def report(self):
+        if not self.downloads:
+            return None
+        return ('Output transfer: ' + str(round(self.bytes / 1048576, 1)) + ' MB downloaded for ' + str(round(self.raw_bytes / 1048576, 1)) + ' MB of frames in '
+                + str(self.downloads) + ' downloads instead of ' + str(self.files) + ', at least ' + str(round(self.saved_seconds())) + 's saved over per-frame raw downloads')
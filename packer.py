@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+DEFLATE_LEVEL = 6
+WINDOW_SIZE = 32 * 1024
+ZIP64_LIMIT = (1 << 31) - 1
+MANIFEST_VERSION = 1
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Formats that are already compressed: deflating them again only burns CPU.
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".webp", ".jp2", ".exr", ".tx", ".dds", ".hdr",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".zst", ".rar",
+    ".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v",
+    ".mp3", ".ogg", ".flac", ".aac", ".m4a", ".opus",
+}
+
+COMPRESSED_MAGICS = (b"\x1f\x8b", b"\x28\xb5\x2f\xfd", b"PK\x03\x04")
+
+def list_directory(project_directory, exclude=()):
+    # exclude: directories left out, such as the render output and cache when they are in the project.
+    exclude = set(os.path.abspath(directory) for directory in exclude)
+    files = []
+    for subdir, dirs, filenames in os.walk(project_directory):
+        dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(subdir, name)) not in exclude]
+        for file in filenames:
+            srcpath = os.path.join(subdir, file)
+            files.append((srcpath, os.path.relpath(srcpath, start=project_directory).replace(os.sep, "/")))
+    return files
+
+def compression_for(srcpath, size):
+    if size == 0 or os.path.splitext(srcpath)[1].lower() in STORED_EXTENSIONS:
+        return ZIP_STORED
+    # .blend files may be saved with gzip (< 3.0) or zstd (>= 3.0) compression.
+    with open(srcpath, 'rb') as infile:
+        head = infile.read(4)
+    if head.startswith(COMPRESSED_MAGICS):
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+def hash_file(srcpath, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(srcpath, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _deflate_chunk(data, dictionary, last):
+    # Raw deflate chunks ended by a sync flush can be concatenated into one stream (as pigz does),
+    # priming each chunk with the tail of the previous one keeps the ratio close to a serial deflate.
+    if dictionary:
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+def _dos_date_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def _local_header(name, method, mtime, crc, compress_size, file_size, zip64):
+    dostime, dosdate = _dos_date_time(mtime)
+    extra = b''
+    if zip64:
+        extra = struct.pack('<HHQQ', 0x0001, 16, file_size, compress_size)
+        compress_size = file_size = 0xFFFFFFFF
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x800, method, dostime, dosdate,
+                       crc, compress_size, file_size, len(name), len(extra)) + name + extra
+
+def _central_header(entry):
+    name = entry['name'].encode('utf-8')
+    dostime, dosdate = _dos_date_time(entry['mtime'])
+    file_size, compress_size, offset = entry['file_size'], entry['compress_size'], entry['header_offset']
+    fields = []
+    if file_size > ZIP64_LIMIT:
+        fields.append(file_size)
+        file_size = 0xFFFFFFFF
+    if compress_size > ZIP64_LIMIT:
+        fields.append(compress_size)
+        compress_size = 0xFFFFFFFF
+    if offset > ZIP64_LIMIT:
+        fields.append(offset)
+        offset = 0xFFFFFFFF
+    extra = struct.pack('<HH' + 'Q' * len(fields), 0x0001, 8 * len(fields), *fields) if fields else b''
+    version = 45 if fields else 20
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, 0x800, entry['method'],
+                       dostime, dosdate, entry['crc'], compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                       (0o100644 << 16), offset) + name + extra
+
+def _end_of_central_directory(count, cd_offset, cd_size):
+    record = b''
+    if count > 0xFFFF or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        record += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        record += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+        count, cd_offset, cd_size = min(count, 0xFFFF), 0xFFFFFFFF, min(cd_size, 0xFFFFFFFF)
+    return record + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+class _ArchiveWriter:
+    def __init__(self, fp, pool, processes, chunk_size):
+        self.fp = fp
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.in_flight = 2 * processes
+        self.entries = []
+
+    def copy_entry(self, source, entry, source_mtime):
+        # Reuse the already compressed bytes of an unchanged file from the previous archive.
+        new_entry = dict(entry, header_offset=self.fp.tell(), source_mtime=source_mtime)
+        source.seek(entry['header_offset'])
+        remaining = entry['entry_size']
+        while remaining:
+            data = source.read(min(self.chunk_size, remaining))
+            if not data:
+                raise IOError("Truncated archive entry " + entry['name'])
+            self.fp.write(data)
+            remaining -= len(data)
+        self.entries.append(new_entry)
+        return new_entry
+
+    def write_file(self, srcpath, name, size, source_mtime):
+        mtime = source_mtime // 1000000000
+        method = compression_for(srcpath, size)
+        zip64 = size * 1.05 > ZIP64_LIMIT
+        encoded_name = name.encode('utf-8')
+        header_offset = self.fp.tell()
+        self.fp.write(_local_header(encoded_name, method, mtime, 0, 0, 0, zip64))
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        digest = hashlib.sha256()
+        pending = []
+        previous = b''
+        with open(srcpath, 'rb') as infile:
+            data = infile.read(self.chunk_size)
+            while data:
+                following = infile.read(self.chunk_size)
+                crc = zlib.crc32(data, crc)
+                digest.update(data)
+                file_size += len(data)
+                if method == ZIP_STORED:
+                    self.fp.write(data)
+                    compress_size += len(data)
+                else:
+                    last = not following
+                    if self.pool:
+                        pending.append(self.pool.submit(_deflate_chunk, data, previous, last))
+                    else:
+                        pending.append(_deflate_chunk(data, previous, last))
+                    previous = data[-WINDOW_SIZE:]
+                    while len(pending) > (self.in_flight if not last else 0):
+                        compressed = pending.pop(0)
+                        compressed = compressed.result() if self.pool else compressed
+                        self.fp.write(compressed)
+                        compress_size += len(compressed)
+                data = following
+
+        end = self.fp.tell()
+        self.fp.seek(header_offset)
+        self.fp.write(_local_header(encoded_name, method, mtime, crc, compress_size, file_size, zip64))
+        self.fp.seek(end)
+
+        entry = {
+            'name': name,
+            'method': method,
+            'mtime': mtime,
+            'source_mtime': source_mtime,
+            'crc': crc,
+            'file_size': file_size,
+            'compress_size': compress_size,
+            'header_offset': header_offset,
+            'entry_size': end - header_offset,
+            'sha256': digest.hexdigest(),
+        }
+        self.entries.append(entry)
+        return entry
+
+    def close(self):
+        cd_offset = self.fp.tell()
+        for entry in self.entries:
+            self.fp.write(_central_header(entry))
+        self.fp.write(_end_of_central_directory(len(self.entries), cd_offset, self.fp.tell() - cd_offset))
+
+def manifest_path(archive_path):
+    return os.path.splitext(archive_path)[0] + ".json"
+
+def load_manifest(archive_path):
+    try:
+        with open(manifest_path(archive_path)) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION and os.path.getsize(archive_path) == manifest['archive_size']:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_manifest(archive_path, manifest):
+    tmp_path = manifest_path(archive_path) + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path(archive_path))
+
+def _unchanged_entry(previous, name, srcpath, size, mtime):
+    entry = previous.get(name)
+    if entry is None or entry['file_size'] != size:
+        return None
+    if entry['source_mtime'] == mtime:
+        return entry
+    # Touched but maybe not modified (checkout, copy): compare content before repacking it.
+    if hash_file(srcpath) == entry['sha256']:
+        return entry
+    return None
+
+def pack_project(files, archive_path, processes=None, chunk_size=CHUNK_SIZE):
+    files = sorted(files, key=lambda file: file[1])
+    manifest = load_manifest(archive_path)
+    previous = {entry['name']: entry for entry in manifest['entries']} if manifest else {}
+
+    stats = []
+    for srcpath, name in files:
+        st = os.stat(srcpath)
+        stats.append((srcpath, name, st.st_size, st.st_mtime_ns))
+
+    unchanged = {}
+    for srcpath, name, size, mtime in stats:
+        entry = _unchanged_entry(previous, name, srcpath, size, mtime)
+        if entry is not None:
+            unchanged[name] = entry
+
+    if manifest and len(unchanged) == len(stats) == len(previous):
+        for srcpath, name, size, mtime in stats:
+            unchanged[name]['source_mtime'] = mtime
+        save_manifest(archive_path, manifest)
+        return archive_path, manifest
+
+    processes = processes or os.cpu_count() or 1
+    tmp_path = archive_path + ".tmp"
+    pool = ProcessPoolExecutor(processes) if processes > 1 else None
+    try:
+        with open(tmp_path, 'wb') as fp, open(archive_path if manifest else os.devnull, 'rb') as source:
+            writer = _ArchiveWriter(fp, pool, processes, chunk_size)
+            for srcpath, name, size, mtime in stats:
+                if name in unchanged:
+                    writer.copy_entry(source, unchanged[name], mtime)
+                else:
+                    writer.write_file(srcpath, name, size, mtime)
+            writer.close()
+            archive_size = fp.tell()
+    finally:
+        if pool:
+            pool.shutdown()
+
+    os.replace(tmp_path, archive_path)
+    manifest = {'version': MANIFEST_VERSION, 'archive_size': archive_size, 'entries': writer.entries}
+    save_manifest(archive_path, manifest)
+    return archive_path, manifest
+
+def _write_chunk(chunk_directory, data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(chunk_directory, digest)
+    if not os.path.exists(path):
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    return {'hash': digest, 'size': len(data)}
+
+def _chunk_ranges(manifest, chunk_size):
+    # Cut points only depend on entry contents (entries are written back to back in name order),
+    # so editing one file leaves the chunks of every other file untouched.
+    start = 0
+    end = 0
+    for entry in manifest['entries']:
+        entry_end = entry['header_offset'] + entry['entry_size']
+        if entry['entry_size'] >= chunk_size:
+            if end > start:
+                yield start, end
+            for offset in range(entry['header_offset'], entry_end, chunk_size):
+                yield offset, min(offset + chunk_size, entry_end)
+            start = end = entry_end
+            continue
+        end = entry_end
+        if end - start >= chunk_size or int(entry['sha256'][:8], 16) % 8 == 0:
+            yield start, end
+            start = end
+    if end > start:
+        yield start, end
+    if manifest['archive_size'] > end:
+        yield end, manifest['archive_size']
+
+def chunk_archive(archive_path, manifest, chunk_directory, chunk_size=UPLOAD_CHUNK_SIZE):
+    os.makedirs(chunk_directory, exist_ok=True)
+    chunks = manifest.get('chunks')
+    if chunks and all(os.path.exists(os.path.join(chunk_directory, chunk['hash'])) for chunk in chunks):
+        return chunks
+
+    chunks = []
+    with open(archive_path, 'rb') as f:
+        for start, end in _chunk_ranges(manifest, chunk_size):
+            f.seek(start)
+            chunks.append(_write_chunk(chunk_directory, f.read(end - start)))
+    manifest['chunks'] = chunks
+    save_manifest(archive_path, manifest)
+    return chunks
+
+def write_chunk_list(chunks, path):
+    with open(path, 'w') as f:
+        for chunk in chunks:
+            f.write(chunk['hash'] + "\n")
+    return path
@@ -0,0 +1,167 @@
+import os
+import math
+import time
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Previews built while a job renders, from the frames accepted so far, so that review can start before
+# the last frame is in: a contact sheet of thumbnails, and a small movie of the frames in order.
+PREVIEW_DIRECTORY = "preview"
+THUMBNAIL_WIDTH = 240
+SHEET_COLUMNS = 10
+# Longer shots get every Nth frame on the sheet.
+SHEET_FRAMES = 300
+# Seconds between two writes of the contact sheet, which is written at the end anyway.
+SHEET_INTERVAL = 10
+MOVIE_WIDTH = 480
+PREVIEW_WORKERS = 2
+
+def load_previews(path, widths):
+    # 8 bit RGB pixels of the image at each width. Float images get a plain sRGB curve, not the scene's
+    # view transform.
+    import numpy as np
+    import OpenImageIO as oiio
+    source = oiio.ImageBuf(path)
+    spec = source.spec()
+    if source.has_error:
+        raise IOError(source.geterror())
+    linear = spec.format.basetype in [oiio.HALF, oiio.FLOAT]
+    previews = []
+    for width in widths:
+        height = max(2, round(spec.height * width / spec.width))
+        resized = oiio.ImageBufAlgo.resize(source, roi=oiio.ROI(0, width, 0, height, 0, 1, 0, spec.nchannels))
+        pixels = resized.get_pixels(oiio.FLOAT)[:, :, :3]
+        if pixels.shape[2] < 3:
+            pixels = np.repeat(pixels[:, :, :1], 3, axis=2)
+        if linear:
+            pixels = np.clip(pixels, 0, 1)
+            pixels = np.where(pixels <= 0.0031308, pixels * 12.92, 1.055 * pixels ** (1 / 2.4) - 0.055)
+        previews.append((np.clip(pixels, 0, 1) * 255 + 0.5).astype(np.uint8))
+    return previews
+
+def write_image(path, pixels):
+    import OpenImageIO as oiio
+    temporary = path + ".tmp" + os.path.splitext(path)[1]
+    output = oiio.ImageOutput.create(temporary)
+    output.open(temporary, oiio.ImageSpec(pixels.shape[1], pixels.shape[0], 3, oiio.UINT8))
+    output.write_image(pixels)
+    output.close()
+    os.replace(temporary, path)
+
+class ContactSheet:
+    def __init__(self, path, frames):
+        self.path = path
+        frames = sorted(frames)
+        self.index = {frame: index for index, frame in enumerate(frames[::max(1, math.ceil(len(frames) / SHEET_FRAMES))])}
+        self.canvas = None
+        self.written_at = 0
+
+    def add(self, frame, pixels):
+        import numpy as np
+        if pixels is None or frame not in self.index:
+            return
+        if self.canvas is None:
+            self.cell = pixels.shape[:2]
+            rows = math.ceil(len(self.index) / SHEET_COLUMNS)
+            self.canvas = np.zeros((rows * self.cell[0], SHEET_COLUMNS * self.cell[1], 3), dtype=np.uint8)
+        row, column = divmod(self.index[frame], SHEET_COLUMNS)
+        tile = pixels[:self.cell[0], :self.cell[1]]
+        top, left = row * self.cell[0], column * self.cell[1]
+        self.canvas[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+        if time.monotonic() - self.written_at > SHEET_INTERVAL:
+            self.write()
+
+    def write(self):
+        write_image(self.path, self.canvas)
+        self.written_at = time.monotonic()
+
+    def close(self):
+        if self.canvas is not None:
+            self.write()
+
+class PreviewMovie:
+    # Frames are encoded as soon as those before them are in. None stands for a frame that could not
+    # be read.
+    def __init__(self, path, frames, fps):
+        self.path = path
+        self.order = sorted(frames)
+        self.fps = fps
+        self.next = 0
+        self.waiting = {}
+        self.process = None
+        self.ffmpeg = shutil.which("ffmpeg")
+        if self.ffmpeg is None:
+            print('ffmpeg not found, no preview movie')
+
+    def add(self, frame, pixels):
+        if self.ffmpeg is None:
+            return
+        self.waiting[frame] = pixels
+        while self.next < len(self.order) and self.order[self.next] in self.waiting:
+            self.write(self.waiting.pop(self.order[self.next]))
+            self.next += 1
+
+    def write(self, pixels):
+        if pixels is None or self.ffmpeg is None:
+            return
+        if self.process is None:
+            self.size = (pixels.shape[1] - pixels.shape[1] % 2, pixels.shape[0] - pixels.shape[0] % 2)
+            self.process = subprocess.Popen([self.ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                                             "-s", str(self.size[0]) + "x" + str(self.size[1]), "-r", str(self.fps), "-i", "-",
+                                             "-pix_fmt", "yuv420p", self.path], stdin=subprocess.PIPE)
+        try:
+            self.process.stdin.write(pixels[:self.size[1], :self.size[0]].tobytes())
+        except OSError as e:
+            print('Preview movie stopped: ' + str(e))
+            self.ffmpeg = None
+
+    def close(self):
+        # Frames still waiting for a missing one go in as they are: the movie has every frame rendered.
+        for frame in sorted(self.waiting):
+            self.write(self.waiting[frame])
+        self.waiting = {}
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.wait()
+
+class Previews:
+    # Frames are read and scaled on a worker pool, then handed to the contact sheet and the movie.
+    def __init__(self, output_directory, frames, frame_path, contact_sheet=False, movie=False, fps=24):
+        directory = os.path.join(output_directory, PREVIEW_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        self.frame_path = frame_path
+        self.encoders = []
+        self.widths = []
+        if contact_sheet:
+            self.encoders.append(ContactSheet(os.path.join(directory, "contact_sheet.png"), frames))
+            self.widths.append(THUMBNAIL_WIDTH)
+        if movie:
+            self.encoders.append(PreviewMovie(os.path.join(directory, "preview.mp4"), frames, fps))
+            self.widths.append(MOVIE_WIDTH)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS)
+
+    def add(self, frames):
+        for frame in frames:
+            self.pool.submit(self.process, frame)
+
+    def process(self, frame):
+        try:
+            previews = load_previews(self.frame_path(frame), self.widths)
+        except Exception as e:
+            print('No preview of frame ' + str(frame) + ': ' + str(e))
+            previews = [None] * len(self.encoders)
+        with self.lock:
+            for encoder, pixels in zip(self.encoders, previews):
+                encoder.add(frame, pixels)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        with self.lock:
+            for encoder in self.encoders:
+                encoder.close()
@@ -0,0 +1,70 @@
+import time
+from collections import deque
+
+from telemetry import ProviderAdded, ProviderRemoved, ChunkStarted, ChunkRendered, FramesFinished, PaymentDue, PaymentAccepted, Estimate
+
+# Window of the frames per minute shown while rendering.
+RATE_WINDOW = 300
+
+class ProgressModel:
+    # What the panel shows, folded from the telemetry events of the render process.
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.in_flight = 0
+        self.failed = 0
+        self.spent = 0.0
+        # Amount due on each agreement not invoiced yet.
+        self.due = {}
+        self.providers = {}
+        self.active = set()
+        self.estimate = None
+        self.started = time.monotonic()
+        self.finished = deque()
+
+    def provider(self, event):
+        if event.provider_id not in self.providers:
+            self.providers[event.provider_id] = {'name': event.name, 'frames': 0, 'since': time.monotonic()}
+        return self.providers[event.provider_id]
+
+    def apply(self, event):
+        if isinstance(event, ProviderAdded):
+            self.provider(event)
+            self.active.add(event.provider_id)
+        elif isinstance(event, ProviderRemoved):
+            self.active.discard(event.provider_id)
+        elif isinstance(event, ChunkStarted):
+            self.in_flight += event.units
+        elif isinstance(event, ChunkRendered):
+            self.in_flight = max(0, self.in_flight - event.units)
+            self.failed += event.failed
+        elif isinstance(event, FramesFinished):
+            self.done += len(event.frames)
+            self.provider(event)['frames'] += len(event.frames)
+            self.finished.extend([time.monotonic()] * len(event.frames))
+        elif isinstance(event, PaymentDue):
+            self.spent += event.amount - self.due.get(event.agreement_id, 0)
+            self.due[event.agreement_id] = event.amount
+        elif isinstance(event, PaymentAccepted):
+            self.spent += event.amount - self.due.pop(event.agreement_id, 0)
+        elif isinstance(event, Estimate):
+            self.estimate = event
+
+    def frames_per_minute(self):
+        now = time.monotonic()
+        while self.finished and now - self.finished[0] > RATE_WINDOW:
+            self.finished.popleft()
+        window = min(RATE_WINDOW, now - self.started)
+        return len(self.finished) * 60 / window if window > 0 else 0
+
+    def eta_seconds(self):
+        rate = self.frames_per_minute()
+        if not rate:
+            return None
+        return (self.total - self.done) * 60 / rate
+
+    def provider_rates(self):
+        now = time.monotonic()
+        return sorted(((provider['name'], provider['frames'] * 60 / max(now - provider['since'], 1))
+                       for provider_id, provider in self.providers.items() if provider_id in self.active),
+                      key=lambda item: item[1], reverse=True)
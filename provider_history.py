@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+
+# Durable per-provider record of past jobs, shared by every project of the user.
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".golem_blender", "providers.sqlite")
+
+# Providers are judged only once they ran enough tasks.
+MIN_TASKS = 3
+MAX_FAILURE_RATE = 0.5
+# Excluded when this many times slower than the average provider on the same scenes.
+MAX_RELATIVE_TIME = 3.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS providers (
+    provider_id TEXT PRIMARY KEY,
+    name TEXT,
+    gpu TEXT,
+    last_seen REAL,
+    tasks INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    timeouts INTEGER NOT NULL DEFAULT 0,
+    frames INTEGER NOT NULL DEFAULT 0,
+    upload_bytes INTEGER NOT NULL DEFAULT 0,
+    upload_seconds REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS frame_times (
+    provider_id TEXT NOT NULL,
+    scene TEXT NOT NULL,
+    frames INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider_id, scene)
+);
+"""
+
+class ProviderHistory:
+    def __init__(self, path=HISTORY_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _update(self, provider_id, assignments, values, name=None):
+        self.connection.execute("INSERT OR IGNORE INTO providers (provider_id) VALUES (?)", (provider_id,))
+        self.connection.execute("UPDATE providers SET last_seen = ?, name = COALESCE(?, name), " + assignments + " WHERE provider_id = ?",
+                                (time.time(), name) + tuple(values) + (provider_id,))
+        self.connection.commit()
+
+    def record_frames(self, provider_id, scene, frames, seconds):
+        self._update(provider_id, "frames = frames + ?", (frames,))
+        self.connection.execute("INSERT OR IGNORE INTO frame_times (provider_id, scene) VALUES (?, ?)", (provider_id, scene))
+        self.connection.execute("UPDATE frame_times SET frames = frames + ?, seconds = seconds + ? WHERE provider_id = ? AND scene = ?",
+                                (frames, seconds, provider_id, scene))
+        self.connection.commit()
+
+    def record_task(self, provider_id, failed=False, name=None):
+        self._update(provider_id, "tasks = tasks + 1, failures = failures + ?", (int(failed),), name)
+
+    def record_timeout(self, provider_id):
+        self._update(provider_id, "tasks = tasks + 1, timeouts = timeouts + 1", ())
+
+    def record_upload(self, provider_id, size, seconds):
+        self._update(provider_id, "upload_bytes = upload_bytes + ?, upload_seconds = upload_seconds + ?", (size, seconds))
+
+    def record_cost(self, provider_id, amount):
+        self._update(provider_id, "cost = cost + ?", (amount,))
+
+    def record_hardware(self, provider_id, gpu):
+        self._update(provider_id, "gpu = ?", (gpu,))
+
+    def relative_time(self, provider_id):
+        # Frame times only compare on the same scene: average the provider's ratio to each scene's mean.
+        rows = self.connection.execute("""
+            SELECT mine.frames, mine.seconds / mine.frames, SUM(everyone.seconds) / SUM(everyone.frames)
+            FROM frame_times AS mine JOIN frame_times AS everyone ON everyone.scene = mine.scene
+            WHERE mine.provider_id = ? AND mine.frames > 0 AND everyone.frames > 0
+            GROUP BY mine.scene""", (provider_id,)).fetchall()
+        frames = sum(row[0] for row in rows)
+        if not frames:
+            return None
+        return sum(row[0] * row[1] / row[2] for row in rows if row[2] > 0) / frames
+
+    def gpu_relative_time(self, gpu):
+        # Providers never seen before are guessed from others advertising the same GPU.
+        times = [self.relative_time(row[0]) for row in self.connection.execute("SELECT provider_id FROM providers WHERE gpu = ?", (gpu,))]
+        times = [value for value in times if value is not None]
+        return sum(times) / len(times) if times else None
+
+    def scene_frame_time(self, scene):
+        row = self.connection.execute("SELECT SUM(seconds) / SUM(frames) FROM frame_times WHERE scene = ? AND frames > 0", (scene,)).fetchone()
+        return row[0] if row else None
+
+    def frame_time(self, provider_id, scene):
+        row = self.connection.execute("SELECT seconds / frames FROM frame_times WHERE provider_id = ? AND scene = ? AND frames > 0",
+                                      (provider_id, scene)).fetchone()
+        return row[0] if row else None
+
+    def stats(self, provider_id):
+        row = self.connection.execute("""
+            SELECT name, tasks, failures, timeouts, frames, upload_bytes, upload_seconds, cost
+            FROM providers WHERE provider_id = ?""", (provider_id,)).fetchone()
+        if row is None:
+            return None
+        name, tasks, failures, timeouts, frames, upload_bytes, upload_seconds, cost = row
+        return {
+            'name': name,
+            'tasks': tasks,
+            'frames': frames,
+            'failure_rate': (failures + timeouts) / tasks if tasks else 0,
+            'timeout_rate': timeouts / tasks if tasks else 0,
+            'upload_rate': upload_bytes / upload_seconds if upload_seconds else None,
+            'cost_per_frame': cost / frames if frames else None,
+            'relative_time': self.relative_time(provider_id),
+        }
+
+    def reliability(self, provider_id):
+        # None excludes the provider, otherwise the share of its tasks expected to succeed.
+        stats = self.stats(provider_id)
+        if stats is None or stats['tasks'] < MIN_TASKS:
+            return 1.0
+        if stats['failure_rate'] > MAX_FAILURE_RATE:
+            return None
+        if (stats['relative_time'] or 1.0) > MAX_RELATIVE_TIME:
+            return None
+        return 1 - stats['failure_rate']
+
+    def weight(self, provider_id):
+        # A factor on the provider's offer score: faster and more reliable is higher.
+        reliability = self.reliability(provider_id)
+        if reliability is None:
+            return None
+        return reliability / (self.relative_time(provider_id) or 1.0)
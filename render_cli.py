@@ -0,0 +1,88 @@
+import sys
+import argparse
+from queue import Queue
+
+from render_daemon import run_daemon
+from job_spec import SpecError, load_spec, spec_paths, job_name, check_spec, daemon_job
+from telemetry import FramesFinished, JobFinished, JobFailed
+from requestor_log import parse_levels
+
+# Renders job specs (see job_spec.py) without Blender's UI, all on one Golem engine:
+#   python render_cli.py shots/ sh120.json --budget 50 --max-jobs 4
+# or from Python:
+#   from render_cli import render_specs
+#   results = render_specs(["shots/"], budget=50, max_jobs=4)
+# Exits with 1 when a job failed or left frames unrendered, 2 when a spec is invalid.
+
+class JobResults:
+    # Prints the progress of the jobs, and keeps how each one ended.
+    def __init__(self):
+        self.frames = {}
+        self.done = {}
+        self.results = {}
+
+    def add(self, job_id, frames):
+        self.frames[job_id] = frames
+        self.done[job_id] = 0
+
+    def put(self, message):
+        job_id, event = message
+        if isinstance(event, FramesFinished):
+            self.done[job_id] += len(event.frames)
+            print(job_id + ': ' + str(self.done[job_id]) + '/' + str(self.frames[job_id]) + ' frames')
+        elif isinstance(event, (JobFinished, JobFailed)) and job_id not in self.results:
+            self.results[job_id] = event
+            print(job_id + ': ' + type(event).__name__ + ' ' + str(tuple(event)))
+
+def render_specs(paths, budget=0, max_jobs=1, log_config=None):
+    # Spec files or directories of spec files. Returns the JobFinished or JobFailed event of each job, by
+    # job name. Raises SpecError before rendering anything when a spec is invalid.
+    specs = []
+    names = set()
+    for path in spec_paths(paths):
+        job_id = job_name(path, names)
+        names.add(job_id)
+        specs.append((job_id, load_spec(path)))
+    # Every spec is checked before the first manifest is written.
+    for job_id, spec in specs:
+        check_spec(spec)
+
+    control = Queue()
+    results = JobResults()
+    for job_id, spec in specs:
+        job = daemon_job(spec)
+        if job is None:
+            print(job_id + ': already rendered')
+            results.results[job_id] = JobFinished(0)
+            continue
+        results.add(job_id, len(job['job']['frames']))
+        control.put(('render', job_id, job))
+    control.put(('stop',))
+    run_daemon(control, results, budget, max_jobs, log_config)
+    for job_id in results.frames:
+        if job_id not in results.results:
+            results.results[job_id] = JobFailed('cancelled')
+    return results.results
+
+def main():
+    parser = argparse.ArgumentParser(description="Render Golem job specs without Blender's UI")
+    parser.add_argument("specs", nargs="+", help="job spec files, or directories of job specs")
+    parser.add_argument("--budget", type=float, default=0, help="GLM shared by the jobs running at once, by default the budget of the first job")
+    parser.add_argument("--max-jobs", type=int, default=1, help="jobs running at once")
+    parser.add_argument("--log", action="append", metavar="API=LEVEL", help="level of yapapi, activity, market, payment or net in requestor.log")
+    parser.add_argument("--log-rotation", default="SIZE", choices=["SIZE", "DAILY"])
+    args = parser.parse_args()
+    try:
+        log_config = {'levels': parse_levels(args.log), 'rotation': args.log_rotation}
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        results = render_specs(args.specs, args.budget, args.max_jobs, log_config)
+    except SpecError as e:
+        print(e)
+        sys.exit(2)
+    if any(isinstance(result, JobFailed) or result.frames_left for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
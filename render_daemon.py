@@ -0,0 +1,308 @@
+import os
+import site
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import itertools
+import platform
+import argparse
+import importlib
+import threading
+import traceback
+from queue import Empty
+from multiprocessing import Process, Queue
+
+from addon_golem import init_payment, get_appkey, run_job, JobEventRouter
+from telemetry import JobFailed, JobFinished
+from job_spec import SpecError, load_spec, spec_paths, job_name, daemon_job
+from requestor_log import RequestorLog, parse_levels
+
+# Requestor process started once per Blender session, or on its own:
+#   python render_daemon.py --spool ~/.golem_blender/spool
+# Payment initialization, the app key and the Golem engine are set up for the first job and reused by
+# the next ones, so that they start negotiating right away. Jobs are sent as
+#   {"priority": 0, "network": "goerli", "budget": 10, "job": {keyword arguments of addon_golem.run_job}}
+DAEMON_DIRECTORY = os.path.join(os.path.expanduser("~"), ".golem_blender")
+SPOOL_DIRECTORY = os.path.join(DAEMON_DIRECTORY, "spool")
+SPOOL_INTERVAL = 1
+SUBNET_TAG = "norbert"
+PAYMENT_DRIVER = "erc20"
+STOP_TIMEOUT = 60
+SCHEDULE_INTERVAL = 1
+
+class JobEvents:
+    # Tags what a job sends with its id: the jobs of the daemon share one event queue.
+    def __init__(self, events, job_id):
+        self.events = events
+        self.job_id = job_id
+
+    def put(self, event):
+        self.events.put((self.job_id, event))
+
+class RequestorSession:
+    # The Golem engine of one payment network, kept running between jobs. A job on another network, or
+    # with a bigger budget than the engine's allocation, gets a new engine.
+    def __init__(self):
+        self.golem = None
+        self.router = None
+        self.network = None
+        self.budget = 0
+        self.initialized = set()
+
+    async def open(self, queue, network, budget):
+        # None when yagna is not usable, which was sent to the queue.
+        if self.golem is not None and network == self.network and budget <= self.budget:
+            return self.golem
+        await self.close()
+        if network not in self.initialized:
+            if not init_payment(queue, network):
+                return None
+            self.initialized.add(network)
+        if 'YAGNA_APPKEY' not in os.environ:
+            os.environ['YAGNA_APPKEY'] = get_appkey()
+
+        from yapapi import Golem
+        from yapapi.strategy import LeastExpensiveLinearPayuMS
+        from market import SessionMarketStrategy
+        golem = Golem(
+            budget=budget,
+            subnet_tag=SUBNET_TAG,
+            payment_driver=PAYMENT_DRIVER,
+            payment_network=network,
+            strategy=SessionMarketStrategy(LeastExpensiveLinearPayuMS()),
+        )
+        await golem.start()
+        # One consumer for the engine's lifetime, whatever the number of jobs.
+        self.router = JobEventRouter()
+        golem.add_event_consumer(self.router, ["JobEvent"])
+        print('Golem engine started on ' + network + ' with a budget of ' + str(budget) + ' GLM')
+        self.golem = golem
+        self.network = network
+        self.budget = budget
+        return golem
+
+    async def close(self):
+        if self.golem is not None:
+            golem = self.golem
+            self.golem = None
+            await golem.stop()
+
+def allocation_failed(error):
+    # No payment account on the network, or yagna refusing an allocation beyond the account's funds.
+    from ya_payment import ApiException
+    from yapapi.engine import NoPaymentAccountError
+    if isinstance(error, NoPaymentAccountError):
+        return True
+    return isinstance(error, ApiException) and "insufficient funds" in str(error.body or "").lower()
+
+async def run_queued_job(session, queue, spec, session_budget):
+    try:
+        golem = await session.open(queue, spec['network'], max(session_budget, spec['budget']))
+    except Exception as e:
+        traceback.print_exc()
+        queue.put(JobFailed('insufficient_funds' if allocation_failed(e) else str(e) or type(e).__name__))
+        return
+    if golem is None:
+        return
+    try:
+        frames_left = await run_job(golem, session.router, queue=queue, budget=spec['budget'], **spec['job'])
+        queue.put(JobFinished(len(frames_left)))
+    except Exception as e:
+        # Frames completed so far are in the job manifest and can be resumed.
+        traceback.print_exc()
+        queue.put(JobFailed(str(e) or type(e).__name__))
+
+async def serve(control, events, budget=0, max_jobs=1, log=None):
+    # Control messages: ('render', job_id, spec), ('cancel', job_id), ('logging', log_config) for the
+    # next jobs' logging and ('stop',), which ends the daemon once the jobs sent before are done. Queued jobs start by priority, then in the order they were sent.
+    # Several run at once on the same engine while their budgets fit in its allocation: `budget` GLM, or
+    # the budget of the first job.
+    loop = asyncio.get_event_loop()
+    queued = []
+    running = {}
+    budgets = {}
+    cancelled = set()
+    changed = asyncio.Event()
+    sequence = itertools.count()
+    state = {'stopping': False}
+    session = RequestorSession()
+
+    def dispatch(messages):
+        for message in messages:
+            if message[0] == 'render':
+                heapq.heappush(queued, (-message[2].get('priority', 0), next(sequence), message[1], message[2]))
+            elif message[0] == 'cancel':
+                cancelled.add(message[1])
+                if message[1] in running:
+                    running[message[1]].cancel()
+            elif message[0] == 'logging':
+                if log is not None:
+                    log.configure(**message[1])
+            elif message[0] == 'stop':
+                state['stopping'] = True
+        changed.set()
+
+    def listen():
+        # Messages already waiting are dispatched together, so that the priorities of a batch of jobs
+        # hold from the first one.
+        while True:
+            messages = [control.get()]
+            while True:
+                try:
+                    messages.append(control.get_nowait())
+                except Empty:
+                    break
+            loop.call_soon_threadsafe(dispatch, messages)
+            if any(message[0] == 'stop' for message in messages):
+                return
+
+    def can_start(spec):
+        if not running:
+            return True
+        return (len(running) < max_jobs and session.golem is not None and spec['network'] == session.network
+                and sum(budgets.values()) + spec['budget'] <= session.budget)
+
+    def finished(job_id, task):
+        del running[job_id]
+        del budgets[job_id]
+        if task.cancelled():
+            print('Job ' + job_id + ' cancelled')
+        changed.set()
+
+    threading.Thread(target=listen, daemon=True).start()
+    try:
+        while queued or running or not state['stopping']:
+            while queued and (queued[0][2] in cancelled or can_start(queued[0][3])):
+                priority, index, job_id, spec = heapq.heappop(queued)
+                if job_id in cancelled:
+                    continue
+                print('Starting job ' + job_id + ' (' + str(len(running) + 1) + ' running, ' + str(len(queued)) + ' queued)')
+                running[job_id] = asyncio.ensure_future(run_queued_job(session, JobEvents(events, job_id), spec, budget))
+                budgets[job_id] = spec['budget']
+                running[job_id].add_done_callback(lambda task, job_id=job_id: finished(job_id, task))
+            changed.clear()
+            try:
+                # Also wakes up once the engine of the first job started, for the jobs that can share it.
+                await asyncio.wait_for(changed.wait(), SCHEDULE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        await session.close()
+
+def run_daemon(control, events, budget=0, max_jobs=1, log_config=None):
+    # log_config: keyword arguments of RequestorLog.configure, levels of each API and rotation.
+    importlib.reload(site)
+
+    if platform.system() == "Linux":
+        os.environ['SSL_CERT_FILE'] = "/etc/ssl/certs/ca-certificates.crt"
+
+    os.makedirs(DAEMON_DIRECTORY, exist_ok=True)
+    log = RequestorLog(DAEMON_DIRECTORY, **(log_config or {}))
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(serve(control, events, budget, max_jobs, log))
+    finally:
+        log.close()
+
+class RenderDaemon:
+    # Handle on the daemon process, for the Blender session that started it.
+    def __init__(self, budget=0, max_jobs=1, log_config=None):
+        self.control = Queue()
+        self.events = Queue()
+        self.process = Process(target=run_daemon, args=(self.control, self.events, budget, max_jobs, log_config))
+        self.process.start()
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def submit(self, spec):
+        job_id = str(uuid.uuid4())
+        self.control.put(('render', job_id, spec))
+        return job_id
+
+    def cancel(self, job_id):
+        self.control.put(('cancel', job_id))
+
+    def set_logging(self, log_config):
+        self.control.put(('logging', log_config))
+
+    def stop(self):
+        # Lets the engine settle the payments of the running agreements before leaving.
+        if self.alive():
+            self.control.put(('stop',))
+            self.process.join(STOP_TIMEOUT)
+        if self.alive():
+            self.process.terminate()
+
+class SpoolEvents:
+    # Prints the events of spooled jobs and moves their spec files along: name.queued, then name.done or
+    # name.failed.
+    def __init__(self, spool_directory):
+        self.spool_directory = spool_directory
+
+    def put(self, message):
+        job_id, event = message
+        print(job_id + ' ' + type(event).__name__ + ' ' + json.dumps(event._asdict()))
+        if isinstance(event, (JobFinished, JobFailed)):
+            self.move(job_id, "done" if isinstance(event, JobFinished) else "failed")
+
+    def move(self, job_id, state):
+        queued = os.path.join(self.spool_directory, job_id + ".queued")
+        if os.path.exists(queued):
+            os.replace(queued, os.path.join(self.spool_directory, job_id + "." + state))
+
+def watch_spool(spool_directory, control, spool_events):
+    # Spec files are those of render_cli.py, see job_spec.py.
+    names = set()
+    while True:
+        for path in spec_paths([spool_directory]):
+            job_id = job_name(path, names)
+            try:
+                spec = load_spec(path)
+            except SpecError as e:
+                if isinstance(e.__context__, ValueError):
+                    # Still being written.
+                    continue
+                print(e)
+                os.replace(path, os.path.join(spool_directory, job_id + ".failed"))
+                continue
+            names.add(job_id)
+            os.replace(path, os.path.join(spool_directory, job_id + ".queued"))
+            try:
+                job = daemon_job(spec)
+            except (SpecError, OSError) as e:
+                print(e)
+                spool_events.move(job_id, "failed")
+                continue
+            if job is None:
+                spool_events.move(job_id, "done")
+                continue
+            control.put(('render', job_id, job))
+        time.sleep(SPOOL_INTERVAL)
+
+def main():
+    parser = argparse.ArgumentParser(description="Golem render daemon running the job specs dropped in a spool directory")
+    parser.add_argument("--spool", default=SPOOL_DIRECTORY)
+    parser.add_argument("--budget", type=float, default=0, help="GLM shared by the jobs running at once")
+    parser.add_argument("--max-jobs", type=int, default=1, help="jobs running at once")
+    parser.add_argument("--log", action="append", metavar="API=LEVEL", help="level of yapapi, activity, market, payment or net in requestor.log")
+    parser.add_argument("--log-rotation", default="SIZE", choices=["SIZE", "DAILY"])
+    args = parser.parse_args()
+    try:
+        log_config = {'levels': parse_levels(args.log), 'rotation': args.log_rotation}
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.spool, exist_ok=True)
+    control = Queue()
+    spool_events = SpoolEvents(args.spool)
+    threading.Thread(target=watch_spool, args=(args.spool, control, spool_events), daemon=True).start()
+    print('Waiting for job specs in ' + args.spool)
+    run_daemon(control, spool_events, args.budget, args.max_jobs, log_config)
+
+if __name__ == "__main__":
+    main()
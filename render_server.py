@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import argparse
+import bpy
+
+# Runs inside Blender on the provider:
+#   blender -b scene.blend -P render_server.py -- --server-dir DIR --output DIR --format PNG
+# The scene stays loaded (and with persistent data, its BVH and kernels too) while renders are
+# requested by dropping "<id>.request" files in DIR, holding {"renders": [{"frame", "output",
+# "format", "overrides"}]}, overrides being scene attribute paths set for that render only.
+# Each request is answered with "<id>.done", one "frame status" line per render. Servers of several GPUs
+# share DIR, each claiming a request by renaming it. "<id>.started" holds the time the request was claimed
+# and the time it was done, for the requestor to know how long it rendered.
+
+POLL_INTERVAL = 0.1
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server-dir", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", required=True)
+    parser.add_argument("--ready-file", default="ready")
+    args, unknown = parser.parse_known_args(argv)
+    return args
+
+def write_atomic(path, text):
+    with open(path + ".tmp", 'w') as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+def resolve(scene, path):
+    owner = scene
+    parts = path.split(".")
+    for part in parts[:-1]:
+        owner = getattr(owner, part)
+    return owner, parts[-1]
+
+def apply_overrides(scene, overrides):
+    previous = {}
+    for path, value in overrides.items():
+        owner, name = resolve(scene, path)
+        previous[path] = getattr(owner, name)
+        setattr(owner, name, value)
+    return previous
+
+def render(scene, frame, output, format, overrides):
+    scene.render.image_settings.file_format = format
+    previous = apply_overrides(scene, overrides)
+    scene.frame_set(frame)
+    scene.render.filepath = output
+    try:
+        bpy.ops.render.render(write_still=True)
+        return "ok"
+    except Exception as e:
+        print("Frame " + str(frame) + " failed: " + str(e))
+        return "error"
+    finally:
+        apply_overrides(scene, previous)
+
+def serve(args):
+    scene = bpy.context.scene
+    scene.render.use_persistent_data = True
+
+    write_atomic(os.path.join(args.server_dir, args.ready_file), str(os.getpid()))
+
+    while not os.path.exists(os.path.join(args.server_dir, "stop")):
+        requests = sorted(file for file in os.listdir(args.server_dir) if file.endswith(".request"))
+        if not requests:
+            time.sleep(POLL_INTERVAL)
+            continue
+        for request in requests:
+            request_path = os.path.join(args.server_dir, request)
+            running_path = request_path[:-len(".request")] + ".running"
+            try:
+                os.rename(request_path, running_path)
+            except FileNotFoundError:
+                continue
+            started_path = request_path[:-len(".request")] + ".started"
+            write_atomic(started_path, str(time.time()) + "\n")
+            with open(running_path) as f:
+                renders = json.load(f)['renders']
+            os.remove(running_path)
+            lines = []
+            for item in renders:
+                status = render(scene, item['frame'], item.get('output', args.output), item.get('format', args.format), item.get('overrides', {}))
+                lines.append(str(item['frame']) + " " + status)
+            with open(started_path, 'a') as f:
+                f.write(str(time.time()) + "\n")
+            write_atomic(request_path[:-len(".request")] + ".done", "\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+    serve(parse_args())
@@ -0,0 +1,103 @@
+import os
+import json
+import logging
+import logging.handlers
+from queue import Queue
+
+# Requestor logging. Records go through a queue to a background thread: the event loop driving uploads
+# and downloads never waits on the log files.
+#   requestor.log: yapapi and the yagna APIs, each at its own level, rotated by size or daily.
+#   summary.log: yapapi's summary of the jobs (agreements, tasks, costs) as JSON lines, always on.
+# DEBUG on an API traces every request and response: gigabytes on long jobs.
+LOG_FORMAT = "[%(asctime)s %(levelname)s %(name)s] %(message)s"
+LOG_FILE = "requestor.log"
+SUMMARY_FILE = "summary.log"
+LOG_BYTES = 100 * 1048576
+LOG_BACKUPS = 5
+API_LOGGERS = {
+    'yapapi': "yapapi",
+    'activity': "ya_activity",
+    'market': "ya_market",
+    'payment': "ya_payment",
+    'net': "ya_net",
+}
+DEFAULT_LEVELS = {
+    'yapapi': "INFO",
+    'activity': "WARNING",
+    'market': "WARNING",
+    'payment': "WARNING",
+    'net': "WARNING",
+}
+
+class SummaryFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({'time': record.created, 'level': record.levelname, 'message': record.getMessage()})
+
+def parse_levels(values):
+    # ["market=DEBUG", "payment=INFO"] from the command line.
+    levels = {}
+    for value in values or []:
+        api, _, level = value.partition("=")
+        if api not in API_LOGGERS or level.upper() not in ["DEBUG", "INFO", "WARNING", "ERROR"]:
+            raise ValueError("expected API=LEVEL with API in " + ", ".join(API_LOGGERS) + ": " + value)
+        levels[api] = level.upper()
+    return levels
+
+class RequestorLog:
+    def __init__(self, directory, levels=None, rotation="SIZE"):
+        self.directory = directory
+        self.rotation = None
+        self.listener = None
+        self.queue = Queue()
+        self.handler = logging.handlers.QueueHandler(self.queue)
+        for name in API_LOGGERS.values():
+            logger = logging.getLogger(name)
+            logger.disabled = False
+            logger.addHandler(self.handler)
+        self.configure(levels, rotation)
+
+    def file_handler(self, rotation):
+        path = os.path.join(self.directory, LOG_FILE)
+        if rotation == "DAILY":
+            handler = logging.handlers.TimedRotatingFileHandler(path, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8")
+        else:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+            # Each session starts its own file, the previous ones are kept as backups.
+            if os.path.exists(path) and os.path.getsize(path):
+                handler.doRollover()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        return handler
+
+    def configure(self, levels=None, rotation="SIZE"):
+        # Levels can change between jobs; a new rotation reopens the files.
+        levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        for api, name in API_LOGGERS.items():
+            logging.getLogger(name).setLevel(levels[api])
+        # Below the level of yapapi, so that the summary is always there.
+        logging.getLogger("yapapi.summary").setLevel(logging.INFO)
+        if rotation == self.rotation:
+            return
+        self.stop()
+        summary = logging.handlers.RotatingFileHandler(os.path.join(self.directory, SUMMARY_FILE), maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+        summary.setFormatter(SummaryFormatter())
+        summary.addFilter(logging.Filter("yapapi.summary"))
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(LOG_FORMAT))
+        console.setLevel(logging.INFO)
+        console.addFilter(logging.Filter("yapapi"))
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler(rotation), summary, console, respect_handler_level=True)
+        self.listener.start()
+        self.rotation = rotation
+
+    def stop(self):
+        # Writes what is still queued.
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+    def close(self):
+        self.stop()
+        for name in API_LOGGERS.values():
+            logging.getLogger(name).removeHandler(self.handler)
@@ -0,0 +1,180 @@
+import math
+import time
+import asyncio
+import statistics
+
+CHUNK_SECONDS = 300
+INITIAL_CHUNK = 4
+MAX_CHUNK = 50
+# A chunk running this many times longer than expected is duplicated on an idle provider.
+SPECULATE_FACTOR = 2.0
+SPECULATE_INTERVAL = 5
+
+def frames_argument(frames):
+    frames = sorted(frames)
+    if len(frames) == 1:
+        return "-f " + str(frames[0])
+    step = frames[1] - frames[0]
+    if step > 0 and all(b - a == step for a, b in zip(frames, frames[1:])):
+        return "-s " + str(frames[0]) + " -e " + str(frames[-1]) + " -j " + str(step) + " -a"
+    return "-f " + ",".join(str(frame) for frame in frames)
+
+class FrameScheduler:
+    # costs: relative render cost of each frame (1 on average) from the cost pre-pass, or None.
+    def __init__(self, frames, workers, chunk_seconds=CHUNK_SECONDS, initial_chunk=INITIAL_CHUNK, max_chunk=MAX_CHUNK, costs=None):
+        self.costs = costs
+        self.pending = self.order(frames)
+        self.workers = max(1, workers)
+        self.chunk_seconds = chunk_seconds
+        self.initial_chunk = initial_chunk
+        self.max_chunk = max_chunk
+        self.outstanding = set()
+        self.completed = set()
+        self.frame_times = []
+        # Frame times divided by the frames' costs: what a frame of average cost takes.
+        self.unit_times = []
+        self.started_at = {}
+        self.chunks = {}
+        # Provider rendering each started chunk, and providers waiting for work with nothing in flight.
+        self.owners = {}
+        self.idle = set()
+        self.speculated = set()
+        self.speculations = 0
+        self.prefetching = 0
+        self.changed = asyncio.Event()
+
+    def order(self, frames):
+        if self.costs is None:
+            return sorted(frames)
+        # Longest processing time first: the heaviest frames must not be the last ones to start.
+        return sorted(frames, key=lambda frame: (-self.cost(frame), frame))
+
+    def cost(self, unit):
+        if self.costs is None:
+            return 1.0
+        return self.costs.get(unit if isinstance(unit, int) else unit[0], 1.0)
+
+    def work(self, chunk):
+        return sum(self.cost(unit) for unit in chunk)
+
+    def frame_time(self):
+        if not self.frame_times:
+            return None
+        return statistics.median(self.frame_times[-100:])
+
+    def unit_time(self):
+        if not self.unit_times:
+            return None
+        return statistics.median(self.unit_times[-100:])
+
+    def chunk_size(self):
+        # Guided self-scheduling: large chunks while plenty of frames remain, single frames at the tail.
+        size = math.ceil(len(self.pending) / (2 * self.workers))
+        unit_time = self.unit_time()
+        if unit_time is None:
+            size = min(size, self.initial_chunk)
+        else:
+            size = min(size, int(self.chunk_seconds / max(unit_time * self.cost(self.pending[0]), 1)))
+        return max(1, min(size, self.max_chunk))
+
+    def next_chunk(self):
+        chunk = self.pending[:self.chunk_size()]
+        del self.pending[:len(chunk)]
+        self.outstanding.update(chunk)
+        return chunk
+
+    def start(self, key, chunk, provider_id=None):
+        self.started_at[key] = time.monotonic()
+        self.chunks[key] = chunk
+        self.owners[key] = provider_id
+
+    def fresh(self, frames):
+        return [frame for frame in frames if frame not in self.completed]
+
+    def finish(self, key, done, failed, seconds=None):
+        # seconds: how long the chunk rendered, when the provider timed it. Otherwise the time since it started.
+        started = self.started_at.pop(key, None)
+        self.chunks.pop(key, None)
+        self.owners.pop(key, None)
+        if seconds is None and started is not None:
+            seconds = time.monotonic() - started
+        frame_time = None
+        if seconds is not None and done:
+            frame_time = seconds / (len(done) + len(failed))
+            self.frame_times.extend([frame_time] * len(done))
+            self.unit_times.extend([seconds / self.work(done + failed)] * len(done))
+        self.completed.update(done)
+        self.outstanding.difference_update(done)
+        self.requeue(failed)
+        return frame_time
+
+    def requeue(self, frames):
+        # Frames still rendering in another chunk, the original of a failed duplicate or the other way
+        # round, wait for it instead of rendering a third time.
+        running = set(frame for chunk in self.chunks.values() for frame in chunk)
+        frames = [frame for frame in frames if frame not in self.completed and frame not in running]
+        self.outstanding.difference_update(frames)
+        self.pending = self.order(set(self.pending).union(frames))
+        self.changed.set()
+
+    def straggler(self):
+        unit_time = self.unit_time()
+        if unit_time is None:
+            return None
+        now = time.monotonic()
+        for key, started in self.started_at.items():
+            if not self.idle - {self.owners.get(key)}:
+                # No idle provider to take it but the one rendering it.
+                continue
+            chunk = [frame for frame in self.fresh(self.chunks[key]) if frame not in self.speculated]
+            if chunk and now - started > SPECULATE_FACTOR * unit_time * self.work(self.chunks[key]):
+                return chunk
+        return None
+
+    def owned(self, chunk, provider_id):
+        # Whether the provider is already rendering frames of chunk: a duplicate it must not take.
+        return any(self.owners.get(key) == provider_id and set(chunk) & set(frames) for key, frames in self.chunks.items())
+
+    def decline(self, chunk):
+        # A duplicate given to the provider of the original: it can go to another one.
+        self.speculated.difference_update(chunk)
+        self.speculations -= 1
+        self.changed.set()
+
+    def idle_started(self, provider_id):
+        self.idle.add(provider_id)
+        self.changed.set()
+
+    def idle_finished(self, provider_id):
+        self.idle.discard(provider_id)
+
+    def prefetch_started(self):
+        self.prefetching += 1
+        self.changed.set()
+
+    def prefetch_finished(self):
+        self.prefetching -= 1
+
+    async def tasks(self, make_task):
+        while True:
+            if self.pending:
+                yield make_task(self.next_chunk())
+            elif self.outstanding and self.prefetching:
+                # A pipelined worker asking for more work must not block while it holds outstanding frames.
+                yield make_task([])
+            elif self.outstanding:
+                # Tail of the job: duplicate a straggling chunk for an idle provider, the first result wins and
+                # the other is ignored.
+                chunk = self.straggler()
+                if chunk:
+                    self.speculated.update(chunk)
+                    self.speculations += 1
+                    yield make_task(chunk)
+                    continue
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), SPECULATE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                return
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+from collections import namedtuple, deque
+
+# Events sent by the render process, to the Blender panel through the multiprocessing queue and to
+# telemetry.jsonl / metrics.prom in the output directory. Byte counts are bytes, durations seconds,
+# amounts GLM.
+ProviderAdded = namedtuple('ProviderAdded', ['provider_id', 'name'])
+ProviderRemoved = namedtuple('ProviderRemoved', ['provider_id', 'name', 'reason'])
+UploadFinished = namedtuple('UploadFinished', ['provider_id', 'name', 'bytes', 'seconds'])
+ChunkStarted = namedtuple('ChunkStarted', ['provider_id', 'name', 'units'])
+ChunkRendered = namedtuple('ChunkRendered', ['provider_id', 'name', 'units', 'failed', 'seconds'])
+DownloadFinished = namedtuple('DownloadFinished', ['provider_id', 'name', 'bytes', 'seconds'])
+FramesFinished = namedtuple('FramesFinished', ['provider_id', 'name', 'frames'])
+FrameRejected = namedtuple('FrameRejected', ['provider_id', 'name', 'frame', 'reason'])
+# PaymentDue: what an agreement has cost so far, from the provider's last accepted debit note. Its
+# PaymentAccepted, once invoiced, replaces it.
+PaymentDue = namedtuple('PaymentDue', ['provider_id', 'name', 'agreement_id', 'amount'])
+PaymentAccepted = namedtuple('PaymentAccepted', ['provider_id', 'name', 'agreement_id', 'amount'])
+Estimate = namedtuple('Estimate', ['cost', 'seconds'])
+JobFailed = namedtuple('JobFailed', ['reason'])
+JobFinished = namedtuple('JobFinished', ['frames_left'])
+
+TELEMETRY_FILE = "telemetry.jsonl"
+METRICS_FILE = "metrics.prom"
+METRICS_INTERVAL = 5
+# Window of the rolling frames per hour.
+RATE_WINDOW = 600
+
+PROVIDER_COUNTERS = {
+    'frames': "golem_render_frames_total",
+    'failed_units': "golem_render_failed_units_total",
+    'rejected_units': "golem_render_rejected_units_total",
+    'render_seconds': "golem_render_render_seconds_total",
+    'upload_bytes': "golem_render_upload_bytes_total",
+    'upload_seconds': "golem_render_upload_seconds_total",
+    'download_bytes': "golem_render_download_bytes_total",
+    'download_seconds': "golem_render_download_seconds_total",
+    'paid': "golem_render_paid_glm_total",
+}
+
+def event_record(event):
+    record = {'event': type(event).__name__, 'time': time.time()}
+    record.update(event._asdict())
+    return record
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+class Telemetry:
+    def __init__(self, output_directory, queue=None):
+        self.output_directory = output_directory
+        self.queue = queue
+        self.log = open(os.path.join(output_directory, TELEMETRY_FILE), 'a')
+        self.providers = {}
+        self.active = set()
+        self.finished = deque()
+        self.frames = 0
+        self.estimate = None
+        self.written_at = 0
+
+    def provider(self, event):
+        if event.provider_id not in self.providers:
+            self.providers[event.provider_id] = dict({name: 0 for name in PROVIDER_COUNTERS}, name=event.name)
+        provider = self.providers[event.provider_id]
+        provider['name'] = event.name or provider['name']
+        return provider
+
+    def emit(self, event):
+        self.log.write(json.dumps(event_record(event)) + "\n")
+        self.log.flush()
+        if isinstance(event, ProviderAdded):
+            self.provider(event)
+            self.active.add(event.provider_id)
+        elif isinstance(event, ProviderRemoved):
+            self.provider(event)
+            self.active.discard(event.provider_id)
+        elif isinstance(event, UploadFinished):
+            provider = self.provider(event)
+            provider['upload_bytes'] += event.bytes
+            provider['upload_seconds'] += event.seconds
+        elif isinstance(event, ChunkRendered):
+            provider = self.provider(event)
+            provider['render_seconds'] += event.seconds
+            provider['failed_units'] += event.failed
+        elif isinstance(event, DownloadFinished):
+            provider = self.provider(event)
+            provider['download_bytes'] += event.bytes
+            provider['download_seconds'] += event.seconds
+        elif isinstance(event, FramesFinished):
+            self.provider(event)['frames'] += len(event.frames)
+            self.frames += len(event.frames)
+            now = time.monotonic()
+            self.finished.extend([now] * len(event.frames))
+        elif isinstance(event, FrameRejected):
+            self.provider(event)['rejected_units'] += 1
+        elif isinstance(event, PaymentAccepted):
+            self.provider(event)['paid'] += event.amount
+        elif isinstance(event, Estimate):
+            self.estimate = event
+        if self.queue is not None:
+            self.queue.put(event)
+        if time.monotonic() - self.written_at > METRICS_INTERVAL:
+            self.write_metrics()
+
+    def frames_per_hour(self):
+        now = time.monotonic()
+        while self.finished and now - self.finished[0] > RATE_WINDOW:
+            self.finished.popleft()
+        return len(self.finished) * 3600 / RATE_WINDOW
+
+    def metrics(self):
+        lines = [
+            "# TYPE golem_render_job_frames_total counter",
+            "golem_render_job_frames_total " + str(self.frames),
+            "# TYPE golem_render_job_frames_per_hour gauge",
+            "golem_render_job_frames_per_hour " + str(self.frames_per_hour()),
+            "# TYPE golem_render_job_providers gauge",
+            "golem_render_job_providers " + str(len(self.active)),
+            "# TYPE golem_render_job_paid_glm_total counter",
+            "golem_render_job_paid_glm_total " + str(sum(provider['paid'] for provider in self.providers.values())),
+        ]
+        if self.estimate:
+            lines += [
+                "# TYPE golem_render_job_estimated_cost_glm gauge",
+                "golem_render_job_estimated_cost_glm " + str(self.estimate.cost),
+                "# TYPE golem_render_job_estimated_seconds gauge",
+                "golem_render_job_estimated_seconds " + str(self.estimate.seconds),
+            ]
+        for counter, metric in PROVIDER_COUNTERS.items():
+            lines.append("# TYPE " + metric + " counter")
+            for provider_id, provider in sorted(self.providers.items()):
+                lines.append(metric + '{provider_id="' + label(provider_id) + '",provider="' + label(provider['name']) + '"} ' + str(provider[counter]))
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        path = os.path.join(self.output_directory, METRICS_FILE)
+        with open(path + ".tmp", 'w') as f:
+            f.write(self.metrics())
+        os.replace(path + ".tmp", path)
+        self.written_at = time.monotonic()
+
+    def close(self):
+        self.write_metrics()
+        self.log.close()
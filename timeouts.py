@@ -0,0 +1,55 @@
+import statistics
+
+# Upload rate assumed until one is measured (bytes/s).
+DEFAULT_UPLOAD_RATE = 1024 * 1024
+UPLOAD_MARGIN = 3.0
+# Floor of every derived timeout: script startup, unzip, blender loading the scene.
+MIN_SECONDS = 60
+RENDER_PERCENTILE = 95
+RENDER_MARGIN = 2.0
+# Frame times needed before the render timeout is derived instead of capped.
+MIN_SAMPLES = 3
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+class AdaptiveTimeouts:
+    # Timeouts derived from what the job measures so far, the panel values being caps.
+    def __init__(self, upload_cap, render_cap, percent=RENDER_PERCENTILE, margin=RENDER_MARGIN):
+        self.upload_cap = upload_cap
+        self.render_cap = render_cap
+        self.percent = percent
+        self.margin = margin
+        self.upload_rates = []
+        self.timed_out = set()
+
+    def record_upload(self, size, seconds):
+        if size and seconds > 0:
+            self.upload_rates.append(size / seconds)
+
+    def upload_rate(self, known_rate=None):
+        if known_rate:
+            return known_rate
+        if self.upload_rates:
+            return statistics.median(self.upload_rates)
+        return DEFAULT_UPLOAD_RATE
+
+    def upload(self, size, known_rate=None):
+        seconds = MIN_SECONDS + UPLOAD_MARGIN * size / self.upload_rate(known_rate)
+        return min(seconds, self.upload_cap)
+
+    def render(self, chunk, frame_times, work=None):
+        # work: the chunk's cost in frames of average cost, when frame_times are per average frame.
+        cap = self.render_cap * len(chunk)
+        # A chunk that already timed out once gets the full cap: it may simply be heavier than the rest.
+        if len(frame_times) < MIN_SAMPLES or any(frame in self.timed_out for frame in chunk):
+            return cap
+        seconds = MIN_SECONDS + self.margin * percentile(frame_times, self.percent) * (len(chunk) if work is None else work)
+        return min(seconds, cap)
+
+    def render_timed_out(self, chunk):
+        self.timed_out.update(chunk)